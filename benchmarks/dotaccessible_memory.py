@@ -0,0 +1,58 @@
+"""Memory held by DotAccessible records
+
+Wraps 1M small decoded json records in DotAccessible, keeps all of them
+alive and reports the memory traced by tracemalloc, per record and in total,
+next to the same records as plain dicts.
+
+    PYTHONPATH=. python benchmarks/dotaccessible_memory.py [records]
+"""
+import json
+import sys
+import tracemalloc
+from time import perf_counter
+
+from jf.process import DotAccessible, dotaccessible
+
+
+def make_lines(n):
+    return [
+        json.dumps(
+            {
+                "id": i,
+                "name": f"user{i}",
+                "active": i % 2 == 0,
+                "parent": None,
+                "address": {"city": "Helsinki", "zip": f"{i % 100000:05}"},
+                "tags": ["a", "b"],
+            }
+        )
+        for i in range(n)
+    ]
+
+
+def measure(lines, wrap):
+    tracemalloc.start()
+    start = perf_counter()
+    records = [wrap(json.loads(line)) for line in lines]
+    elapsed = perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(records), size, elapsed
+
+
+def main(n=1_000_000):
+    lines = make_lines(n)
+    print(f"{'type':>13} {'records':>8} {'MB':>8} {'B/record':>9} {'seconds':>8}")
+    for label, wrap in [
+        ("dict", lambda x: x),
+        ("DotAccessible", DotAccessible),
+        ("dotaccessible", dotaccessible),
+    ]:
+        count, size, elapsed = measure(lines, wrap)
+        print(
+            f"{label:>13} {count:>8} {size / 1e6:>8.1f} {size / count:>9.0f} {elapsed:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""Throughput of jsonlgen record splitting as a function of the chunk size
+
+Splits the same 64 MB of small jsonl records fed in chunks from 4 KB up to
+64 MB. Emitting a record should cost O(record length), so the throughput
+should stay flat over the whole range.
+
+    make bench  # or: PYTHONPATH=. python benchmarks/jsonlgen_chunksize.py [total MB]
+"""
+import json
+import sys
+from time import perf_counter
+
+from jf import jsonlgen
+
+
+def make_data(size):
+    line = (json.dumps({"id": 123456, "name": "abcdefghijkl", "tags": ["a", "b"]}) + "\n").encode()
+    return line * (size // len(line))
+
+
+def split(data, chunksize):
+    view = memoryview(data)
+    return [view[i : i + chunksize] for i in range(0, len(data), chunksize)]
+
+
+def bench(data, chunksize, as_bytes=True):
+    chunks = split(data, chunksize)
+    start = perf_counter()
+    n = sum(1 for _ in jsonlgen.gen(chunks, as_bytes=as_bytes))
+    return n, perf_counter() - start
+
+
+def main(total_mb=64):
+    data = make_data(total_mb << 20)
+    print(f"{'chunk':>10} {'records':>10} {'seconds':>8} {'MB/s':>8}")
+    chunksize = 4 << 10
+    while chunksize <= len(data):
+        n, elapsed = bench(data, chunksize)
+        print(f"{chunksize >> 10:>8}KB {n:>10} {elapsed:>8.3f} {len(data) / elapsed / 1e6:>8.1f}")
+        chunksize *= 4
+    n, elapsed = bench(data, len(data))
+    print(f"{len(data) >> 10:>8}KB {n:>10} {elapsed:>8.3f} {len(data) / elapsed / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,13 @@
+from .process import Query
+
+
+def compile(query, imports=(), init=(), **kwargs):
+    """
+    Compile a query for running it repeatedly
+
+    >>> import jf
+    >>> query = jf.compile("(.a > 1), {b: .a}")
+    >>> list(query([{"a": 1}, {"a": 2}]))
+    [{'b': 2}]
+    """
+    return Query(query, imports=imports, init=init, **kwargs)
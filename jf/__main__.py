@@ -35,6 +35,38 @@ from .main import jf
     help="output format (json, yaml, excel, csv, ...)",
     default="json",
 )
+@click.option(
+    "--prefetch",
+    help="number of input files to read and decompress ahead in background threads.",
+    default=2,
+)
+@click.option(
+    "--interleave",
+    help="yield records of json inputs as files are read instead of in file order.",
+    is_flag=True,
+)
+@click.option(
+    "--index",
+    help="build .jfidx record offset indexes for json lines inputs, used to seek in them.",
+    is_flag=True,
+)
+@click.option(
+    "--unordered",
+    help="with --processes, output results as workers finish them instead of in input order. first, last, firstnlast and islice keep the input order.",
+    is_flag=True,
+)
+@click.option(
+    "--cache-info",
+    "cache_info",
+    help="show the location and size of the compiled query cache and exit.",
+    is_flag=True,
+)
+@click.option(
+    "--clear-cache",
+    "clear_cache",
+    help="remove all compiled queries from the cache and exit.",
+    is_flag=True,
+)
 @click.argument("query_and_files", nargs=-1, default=None)
 def main(
     processes,
@@ -49,7 +81,24 @@ def main(
     debug,
     raw,
     init,
+    prefetch,
+    interleave,
+    index,
+    unordered,
+    cache_info,
+    clear_cache,
 ):
+    if cache_info or clear_cache:
+        from . import query_parser
+
+        if clear_cache:
+            click.echo(f"Removed {query_parser.clear_cache()} cached queries")
+        if cache_info:
+            info = query_parser.cache_info()
+            click.echo(
+                f"{info['directory']}: {info['entries']} queries, {info['bytes']} bytes"
+            )
+        return
     return jf(
         processes,
         query_and_files,
@@ -63,6 +112,10 @@ def main(
         debug,
         raw,
         init,
+        prefetch=prefetch,
+        interleave=interleave,
+        index=index,
+        unordered=unordered,
     )
 
 
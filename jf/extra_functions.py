@@ -1,8 +1,10 @@
-from .meta import JFTransformation
-from itertools import islice, chain
-from queue import deque
+from .meta import JFTransformation, register
+from itertools import chain, islice as _islice
+from collections import deque
+import heapq
 
 
+@register("function")
 class Flatten(JFTransformation):
     """Yield all subitems of all item
 
@@ -35,6 +37,7 @@ class Flatten(JFTransformation):
             yield self._flatten(it)
 
 
+@register("function")
 class JfDel(JFTransformation):
     """Yield all subitems of all item
 
@@ -53,6 +56,7 @@ class JfDel(JFTransformation):
             yield item
 
 
+@register("function")
 class YieldFrom(JFTransformation):
     """Yield all subitems of all item
 
@@ -66,6 +70,7 @@ class YieldFrom(JFTransformation):
                 yield val
 
 
+@register("function")
 class GroupBy(JFTransformation):
     """Group items by value
 
@@ -78,6 +83,11 @@ class GroupBy(JFTransformation):
             yield list(arr)
             return
 
+        yield self.partial(arr)
+
+    def partial(self, arr):
+        if len(self.args) == 0:
+            return list(arr)
         ret = {}
         for item in arr:
             val = self.args[0](item)
@@ -85,9 +95,29 @@ class GroupBy(JFTransformation):
                 ret[val].append(item)
             else:
                 ret[val] = [item]
+        return ret
+
+    def combine(self, partials):
+        """
+        >>> group_by = GroupBy(lambda x: x["a"])
+        >>> list(group_by.combine([group_by.partial([{"a": 1}, {"a": 2}]),
+        ...                        group_by.partial([{"a": 1}])]))
+        [{1: [{'a': 1}, {'a': 1}], 2: [{'a': 2}]}]
+        """
+        if len(self.args) == 0:
+            yield list(chain.from_iterable(partials))
+            return
+        ret = {}
+        for part in partials:
+            for val, items in part.items():
+                if val in ret:
+                    ret[val].extend(items)
+                else:
+                    ret[val] = items
         yield ret
 
 
+@register("function")
 class Transpose(JFTransformation):
     """Transpose input
     >>> list(Transpose(lambda x: x["a"])([{"a": 1}, {"a": 1}, {"a": 2}]))
@@ -101,6 +131,7 @@ class Transpose(JFTransformation):
         yield df.to_dict(orient="list")
 
 
+@register("function")
 class Unique(JFTransformation):
     """Calculate unique according to function
 
@@ -126,7 +157,20 @@ class Unique(JFTransformation):
                 seen.add(h)
                 yield it
 
+    def partial(self, arr):
+        return list(self._fn(arr))
+
+    def combine(self, partials):
+        """
+        >>> unique = Unique(lambda x: x["a"])
+        >>> list(unique.combine([unique.partial([{"a": 1}, {"a": 2}]),
+        ...                      unique.partial([{"a": 2}, {"a": 3}])]))
+        [{'a': 1}, {'a': 2}, {'a': 3}]
+        """
+        return self._fn(chain.from_iterable(partials))
+
 
+@register("function", "firstnlast", "headntail")
 class Firstnlast(JFTransformation):
     """
     Show first and last (N) items
@@ -136,6 +180,8 @@ class Firstnlast(JFTransformation):
     [[{'a': 1}], [{'a': 2}]]
     """
 
+    ordered = True
+
     def _fn(self, arr):
         shown = 1
         if len(self.args) == 1:
@@ -144,9 +190,10 @@ class Firstnlast(JFTransformation):
             shown = shown(1)
         if not isinstance(shown, int):
             shown = 1
-        return [list(islice(arr, 0, shown)), list(iter(deque(arr, maxlen=shown)))]
+        return [list(_islice(arr, 0, shown)), list(iter(deque(arr, maxlen=shown)))]
 
 
+@register("function")
 class Chain(JFTransformation):
     """
     Show only the first (N) value(s)
@@ -160,6 +207,25 @@ class Chain(JFTransformation):
         return ret
 
 
+@register("function")
+class Count(JFTransformation):
+    """
+    Count the items
+    >>> list(Count()([{"a": 1}, {"a": 1}, {"a": 2}]))
+    [3]
+    """
+
+    def _fn(self, arr):
+        yield self.partial(arr)
+
+    def partial(self, arr):
+        return sum(1 for _ in arr)
+
+    def combine(self, partials):
+        yield sum(partials)
+
+
+@register("function", "first", "head")
 class First(JFTransformation):
     """
     Show only the first (N) value(s)
@@ -169,6 +235,8 @@ class First(JFTransformation):
     [{'a': 1}]
     """
 
+    ordered = True
+
     def _fn(self, arr):
         shown = 1
         if len(self.args) == 1:
@@ -177,10 +245,11 @@ class First(JFTransformation):
             shown = shown(1)
         if not isinstance(shown, int):
             shown = 1
-        ret = islice(arr, 0, shown)
+        ret = _islice(arr, 0, shown)
         return ret
 
 
+@register("function", "last", "tail")
 class Last(JFTransformation):
     """
     Show only the last (N) value(s)
@@ -188,9 +257,13 @@ class Last(JFTransformation):
     [{'a': 2}]
     >>> list(Last("1")([{"a": 1}, {"a": 1}, {"a": 2}]))
     [{'a': 2}]
+    >>> list(Last(lambda x: 2)(iter([{"a": 1}, {"a": 1}, {"a": 2}])))
+    [{'a': 1}, {'a': 2}]
     """
 
-    def _fn(self, arr):
+    ordered = True
+
+    def _shown(self):
         shown = 1
         if len(self.args) == 1:
             shown = self.args[0]
@@ -198,10 +271,48 @@ class Last(JFTransformation):
             shown = shown(1)
         if not isinstance(shown, int):
             shown = 1
-        ret = reversed(list(First(shown)(reversed(arr))))
-        return ret
+        return shown
+
+    def _fn(self, arr):
+        return iter(deque(arr, maxlen=self._shown()))
+
+    def partial(self, arr):
+        return list(self._fn(arr))
+
+    def combine(self, partials):
+        return self._fn(chain.from_iterable(partials))
+
+    def seek(self, source):
+        return source.tail(self._shown())
+
+
+@register("function")
+class Islice(JFTransformation):
+    """
+    Show the values from start to stop, like itertools.islice
+    >>> list(Islice(lambda x: 1, 3)([{"a": 1}, {"a": 2}, {"a": 3}, {"a": 4}]))
+    [{'a': 2}, {'a': 3}]
+    >>> list(Islice(lambda x: 2)([{"a": 1}, {"a": 2}, {"a": 3}]))
+    [{'a': 1}, {'a': 2}]
+    """
 
+    ordered = True
 
+    def _slice(self):
+        return slice(*[arg(1) if callable(arg) else arg for arg in self.args])
+
+    def _fn(self, arr):
+        s = self._slice()
+        return _islice(arr, s.start, s.stop, s.step)
+
+    def seek(self, source):
+        s = self._slice()
+        if s.step not in (None, 1):
+            return self._fn(source)
+        return source.islice(s.start or 0, s.stop)
+
+
+@register("function")
 class Sorted(JFTransformation):
     """
     Sort items based on the column value
@@ -209,14 +320,30 @@ class Sorted(JFTransformation):
     [{'a': 1}, {'a': 2}, {'a': 3}]
     """
 
-    def _fn(self, X):
-        keyget = None
+    def _keyget(self):
         if len(self.args) == 1:
-            keyget = self.args[0]
-        ret = sorted(X, key=keyget, **self.kwargs)
+            return self.args[0]
+
+    def _fn(self, X):
+        ret = sorted(X, key=self._keyget(), **self.kwargs)
         return ret
 
+    def partial(self, arr):
+        return self._fn(arr)
+
+    def combine(self, partials):
+        """
+        Merge the sorted runs. Equal items keep their order, like in sorted.
+
+        >>> by_a = Sorted(lambda x: x["a"])
+        >>> list(by_a.combine([by_a.partial([{"a": 3, "b": 1}, {"a": 1}]),
+        ...                    by_a.partial([{"a": 2}, {"a": 3, "b": 2}])]))
+        [{'a': 1}, {'a': 2}, {'a': 3, 'b': 1}, {'a': 3, 'b': 2}]
+        """
+        return heapq.merge(*partials, key=self._keyget(), **self.kwargs)
+
 
+@register("function")
 class Print(JFTransformation):
     """
     Print (n) values
@@ -231,7 +358,7 @@ class Print(JFTransformation):
 
     def _fn(self, arr):
         import sys
-        import json
+        from .jfio import dump_json
 
         n = 1
         if len(self.args) > 0:
@@ -239,11 +366,12 @@ class Print(JFTransformation):
         if callable(n):
             n = n(1)
         arr = list(arr)
-        for it in islice(arr, 0, n):
-            sys.stderr.write(json.dumps(it) + "\n")
+        for it in _islice(arr, 0, n):
+            sys.stderr.write(dump_json(it, compact=True) + "\n")
         return arr
 
 
+@register("function")
 def age(datestr):
     """
     Age of a datetime string
@@ -1,108 +1,1354 @@
 import json
-from jf.process import DotAccessible, undotaccessible
+from jf.meta import lookup, register, register_module
+from jf.process import (
+    DotAccessibleNone,
+    LazyRecord,
+    SerializedLines,
+    materialize_lazy,
+    undotaccessible,
+)
 
 
-def yield_json_and_json_lines(inp):
+def yield_json_and_json_lines(
+    inp, as_bytes=False, parse=False, loads=None, lazy=False
+):
     """Yield json and json lines
 
     Split potentially huge json strings into lines or components for low memory data processing.
 
     Notice: Results are still json strings, so you most likely want to json.loads them.
 
+    The input may be an iterable of str or of bytes-like chunks (bytes,
+    bytearray, memoryview). Bytes-like chunks are scanned in place and with
+    as_bytes=True each item is copied only once, straight into the bytes
+    object that json.loads accepts.
+
+    >>> list(yield_json_and_json_lines(['[{"a": 1}, {"b"', ': 2}]']))
+    ['{"a": 1}', '{"b": 2}']
+    >>> list(yield_json_and_json_lines([b'{"a": 1}\\n{"b"', memoryview(b': 2}\\n')], as_bytes=True))
+    [b'{"a": 1}', b'{"b": 2}']
+
+    With parse=True the items are decoded into python objects while they are
+    split, without the intermediate strings. Items the built-in decoder does
+    not handle (NaN, huge integers, invalid json) are passed to loads, which
+    defaults to json.loads.
+
+    >>> list(yield_json_and_json_lines([b'{"a": [1, 2.5, null]}\\n{"b": NaN}'], parse=True))
+    [{'a': [1, 2.5, None]}, {'b': nan}]
+
+    With lazy=True objects become LazyRecords that decode fields on access,
+    apart from small ones.
+
+    >>> items = [b'{"a": 1}\\n"b"\\n{"a": "%s"}' % (b"x" * LAZY_MIN_SIZE)]
+    >>> [type(it).__name__ for it in yield_json_and_json_lines(items, lazy=True)]
+    ['dict', 'str', 'LazyRecord']
+    """
+    from . import jsonlgen
+
+    if lazy:
+        return yield_lazy_json(jsonlgen.gen(iter(inp), as_bytes=True), loads)
+    return jsonlgen.gen(iter(inp), as_bytes=as_bytes, parse=parse, loads=loads)
+
+
+# Objects shorter than this are decoded right away, since locating a few
+# fields costs as much as decoding all of them
+LAZY_MIN_SIZE = 128
+
+
+def yield_lazy_json(items, loads=None):
+    """Wrap json objects given as bytes into LazyRecords, decode other items"""
+    from . import jsonlgen
+
+    loads = loads or json.loads
+    for item in items:
+        if len(item) >= LAZY_MIN_SIZE and item.lstrip()[:1] == b"{":
+            yield LazyRecord(item)
+        else:
+            yield jsonlgen.loads(item, loads)
+
+
+MMAP_THRESHOLD = 1 << 20
+
+
+def use_mmap(fn, threshold=None):
+    """
+    Should the file be read through a memory map
+
+    Only regular uncompressed files above the threshold are mapped. Streams
+    (stdin, pipes) and compressed files keep using the streaming readers.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b'{"a": 1}\\n' * 10) and True
+    ...     tmpfile.flush()
+    ...     use_mmap(tmpfile.name), use_mmap(tmpfile.name, threshold=10)
+    True
+    (False, True)
+    >>> use_mmap("-")
+    False
+    """
+    import os
+    import stat
+
+    threshold = MMAP_THRESHOLD if threshold is None else threshold
+    try:
+        st = os.stat(fn)
+    except (OSError, ValueError):
+        return False
+    if not stat.S_ISREG(st.st_mode) or st.st_size < max(threshold, 1):
+        return False
+    return not is_compressed(fn)
+
+
+def yield_mmap_json(fn, loads=None, start=0, end=None, lazy=False, raw=False):
+    """Yield json items of a memory mapped file
+
+    The whole mapping is handed to the splitter as a single buffer, so no
+    per-line python objects are created and reading is left to the page cache.
+    With start and end only that byte range of the file is read. With raw
+    the items are yielded as bytes without parsing them.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b'{"a": 1}\\n{"a": 2}\\n') and True
+    ...     tmpfile.flush()
+    ...     list(yield_mmap_json(tmpfile.name)), list(yield_mmap_json(tmpfile.name, start=9))
+    True
+    ([{'a': 1}, {'a': 2}], [{'a': 2}])
+    """
+    import mmap
+
+    with open(fn, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, "madvise"):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(m)[start:end]
+            items = yield_json_and_json_lines(
+                [view], as_bytes=raw, parse=not raw, loads=loads, lazy=lazy
+            )
+            try:
+                yield from items
+            finally:
+                # The splitter holds the mapping until it is released
+                del items
+                view.release()
+
+
+def newline_ranges(fn, size):
+    """
+    Split a file into byte ranges of about size bytes that end at newlines
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b'{"a": 1}\\n{"a": 22}\\n{"a": 3}\\n') and True
+    ...     tmpfile.flush()
+    ...     newline_ranges(tmpfile.name, 12)
+    True
+    [(0, 19), (19, 28)]
+    """
+    import os
+
+    total = os.path.getsize(fn)
+    ranges = []
+    start = 0
+    with open(fn, "rb") as f:
+        while start < total:
+            end = start + max(size, 1)
+            if end < total:
+                f.seek(end - 1)
+                f.readline()
+                end = min(f.tell(), total)
+            else:
+                end = total
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+JSONL_SAMPLE_LINES = 8
+
+
+def is_jsonl_file(fn, threshold=None):
     """
+    Does the file look like a big enough uncompressed json lines file
+
+    Only an index or the first and last lines of the file are checked.
+    Sharding and seeking split the file at newlines, so they also need the
+    index of jsonl_index, which checks every record.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b'{"a": 1}\\n' * 10) and True
+    ...     tmpfile.flush()
+    ...     is_jsonl_file(tmpfile.name), is_jsonl_file(tmpfile.name, threshold=1)
+    True
+    (False, True)
+    >>> with tempfile.NamedTemporaryFile(suffix=".json") as tmpfile:
+    ...     tmpfile.write(b'{\\n  "a": 1\\n}\\n{\\n  "a": 2\\n}\\n') and True
+    ...     tmpfile.flush()
+    ...     is_jsonl_file(tmpfile.name, threshold=1)
+    True
+    False
+    """
+    import mmap
+
+    if not use_mmap(fn, threshold):
+        return False
+    if read_index(fn) is not None:
+        return True
+    with open(fn, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            head = skip_records(m, 0, JSONL_SAMPLE_LINES)
+            tail = tail_offset(m, JSONL_SAMPLE_LINES)
+            if head is None or head >= tail:
+                # Small files are checked whole
+                lines = m[:].splitlines()
+            else:
+                lines = m[:head].splitlines() + m[tail:].splitlines()
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return False
+    for line in lines:
+        if line.lstrip()[:1] != b"{":
+            return False
+        try:
+            json.loads(line)
+        except ValueError:
+            return False
+    return True
+
+
+INDEX_STRIDE = 1000
+INDEX_SUFFIX = ".jfidx"
+INDEX_VERSION = 2
+
+
+def skip_records(m, offset, count):
+    """
+    Offset of the record count records after the one at offset
+
+    Records are the non-blank lines of a json lines file. Returns None if the
+    file ends before that.
+
+    >>> skip_records(b'{"a": 1}\\n\\n{"a": 2}\\n{"a": 3}\\n', 0, 2), skip_records(b'{}\\n', 0, 1)
+    (19, None)
+    """
+    size = len(m)
+    while offset < size:
+        end = m.find(b"\n", offset)
+        if end < 0:
+            end = size
+        if end > offset and (m[offset] not in b" \t\r" or not m[offset:end].isspace()):
+            if count == 0:
+                return offset
+            count -= 1
+        offset = end + 1
+    return None
+
+
+def tail_offset(m, count):
+    """
+    Offset of the count:th record from the end, reading backwards from the end
+
+    >>> tail_offset(b'{"a": 1}\\n{"a": 2}\\n\\n{"a": 3}\\n', 2)
+    9
+    """
+    end = len(m)
+    if count <= 0:
+        return end
+    while end > 0:
+        start = m.rfind(b"\n", 0, end) + 1
+        if end > start and (m[start] not in b" \t\r" or not m[start:end].isspace()):
+            count -= 1
+            if count == 0:
+                return start
+        end = start - 1
+    return 0
+
+
+def index_path(fn):
+    return fn + INDEX_SUFFIX
+
+
+def read_index(fn):
+    """
+    Sidecar index of a json lines file, if there is one for its current version
+
+    The index is a json header line followed by the byte offsets of every
+    stride:th record as little endian 64 bit integers.
+    """
+    import os
+    import sys
+    from array import array
+
+    try:
+        st = os.stat(fn)
+        with open(index_path(fn), "rb") as f:
+            index = json.loads(f.readline())
+            offsets = array("q")
+            offsets.frombytes(f.read())
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(index, dict)
+        or index.get("version") != INDEX_VERSION
+        or index.get("size") != st.st_size
+        or index.get("mtime_ns") != st.st_mtime_ns
+    ):
+        return None
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    index["offsets"] = offsets
+    return index
+
+
+def build_index(fn, stride=INDEX_STRIDE):
+    """
+    Write a sidecar index with the offset of every stride:th record of fn
+
+    Every non-blank line has to be one complete json object, which the
+    splitter of jsonlgen checks while the lines are scanned. Otherwise no
+    index is written and None is returned.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     with open(f"{tmpdir}/a.jsonl", "wb") as f:
+    ...         _ = f.write(b'{"a": 1}\\n{"a": 2}\\n\\n{"a": 3}\\n')
+    ...     index = build_index(f"{tmpdir}/a.jsonl", stride=2)
+    ...     index == read_index(f"{tmpdir}/a.jsonl"), index["count"], list(index["offsets"])
+    (True, 3, [0, 19])
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     with open(f"{tmpdir}/a.json", "wb") as f:
+    ...         _ = f.write(b'{"a": 1}\\n{\\n  "a": 2\\n}\\n{"a": 3}\\n')
+    ...     build_index(f"{tmpdir}/a.json"), read_index(f"{tmpdir}/a.json")
+    (None, None)
+    """
+    import mmap
+    import os
+    import sys
+    from array import array
     from . import jsonlgen
 
-    return jsonlgen.gen(iter(inp))
+    st = os.stat(fn)
+    offsets = array("q")
+    count = 0
+    if st.st_size:
+        with open(fn, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                items = jsonlgen.gen([view], as_bytes=True)
+                try:
+                    offset = skip_records(m, 0, 0)
+                    while offset is not None:
+                        end = m.find(b"\n", offset)
+                        end = len(m) if end < 0 else end
+                        item = next(items, None)
+                        # The next item has to be all of the line
+                        if item is None or len(item) != len(m[offset:end].strip()):
+                            return None
+                        if count % stride == 0:
+                            offsets.append(offset)
+                        count += 1
+                        offset = skip_records(m, end + 1, 0)
+                    if next(items, None) is not None:
+                        return None
+                finally:
+                    del items
+                    view.release()
+    index = dict(
+        version=INDEX_VERSION,
+        stride=stride,
+        count=count,
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+    )
+    data = array("q", offsets)
+    if sys.byteorder != "little":
+        data.byteswap()
+    tmpfn = f"{index_path(fn)}.{os.getpid()}"
+    try:
+        with open(tmpfn, "wb") as f:
+            f.write(json.dumps(index).encode() + b"\n")
+            f.write(data.tobytes())
+        os.replace(tmpfn, index_path(fn))
+    except OSError:
+        # An index that can not be saved is still good for this run
+        if os.path.exists(tmpfn):
+            os.unlink(tmpfn)
+    index["offsets"] = offsets
+    return index
+
+
+def jsonl_index(fn):
+    """
+    Index of a json lines file, built on first use
+
+    None if the file is not line delimited, so that it has to be streamed.
+    """
+    return read_index(fn) or build_index(fn)
+
+
+def record_offset(m, n, index=None):
+    """Offset of record n, starting from the closest indexed record"""
+    if index is None:
+        return skip_records(m, 0, n)
+    i = n // index["stride"]
+    if i >= len(index["offsets"]):
+        return None
+    return skip_records(m, index["offsets"][i], n - i * index["stride"])
+
 
+def yield_record_range(fn, start=0, stop=None, lazy=False, loads=None, index=None):
+    """
+    Yield records start to stop of a json lines file
+
+    Only the lines before start are scanned, and with a sidecar index not
+    even those.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b''.join(b'{"a": %d}\\n' % i for i in range(10))) and True
+    ...     tmpfile.flush()
+    ...     list(yield_record_range(tmpfile.name, 3, 5))
+    True
+    [{'a': 3}, {'a': 4}]
+    """
+    import mmap
+    import os
+
+    if (stop is not None and stop <= start) or not os.path.getsize(fn):
+        return
+    index = index or read_index(fn)
+    with open(fn, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            begin = record_offset(m, start, index)
+            end = None if stop is None else record_offset(m, stop, index)
+    if begin is not None:
+        yield from yield_mmap_json(
+            fn, loads=loads or try_json_loads, start=begin, end=end, lazy=lazy
+        )
+
+
+def yield_last_records(fn, count, lazy=False, loads=None):
+    """
+    Yield the last count records of a json lines file, reading it from the end
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b''.join(b'{"a": %d}\\n' % i for i in range(10))) and True
+    ...     tmpfile.flush()
+    ...     list(yield_last_records(tmpfile.name, 2))
+    True
+    [{'a': 8}, {'a': 9}]
+    """
+    import mmap
+    import os
+
+    if count <= 0 or not os.path.getsize(fn):
+        return
+    with open(fn, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            begin = tail_offset(m, count)
+    yield from yield_mmap_json(fn, loads=loads or try_json_loads, start=begin, lazy=lazy)
+
+
+BLOCK_SIZE = 1 << 20
+
+
+CODECS = []
+
+
+def register_codec(name, magic, opener):
+    """
+    Register a decompressor for streams starting with magic
+
+    opener gets a binary file object and returns a file object of the
+    decompressed stream.
+    """
+    CODECS.append((name, magic, opener))
+
+
+def _open_gzip(f):
+    import gzip
+
+    return gzip.GzipFile(fileobj=f, mode="rb")
+
+
+def _open_bz2(f):
+    import bz2
+
+    return bz2.BZ2File(f, "rb")
+
+
+def _open_xz(f):
+    import lzma
+
+    return lzma.LZMAFile(f, "rb")
+
+
+def _open_zstd(f):
+    try:
+        from compression import zstd
+
+        return zstd.ZstdFile(f, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading zstd requires python 3.14 or: pip install zstandard")
+    return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+
+
+def _open_lz4(f):
+    try:
+        import lz4.frame
+    except ImportError:
+        raise ImportError("Reading lz4 requires: pip install lz4")
+    return lz4.frame.LZ4FrameFile(f, "rb")
+
+
+register_codec("gzip", b"\x1f\x8b", _open_gzip)
+register_codec("bz2", b"BZh", _open_bz2)
+register_codec("xz", b"\xfd7zXZ\x00", _open_xz)
+register_codec("zstd", b"\x28\xb5\x2f\xfd", _open_zstd)
+register_codec("lz4", b"\x04\x22\x4d\x18", _open_lz4)
+
+
+def sniff_codec(f):
+    """
+    Name and opener of the codec of a binary stream, None if uncompressed
+
+    The stream is not consumed: peek is used when available, otherwise the
+    stream is seeked back.
 
-class MinimalAdapter:
+    >>> import gzip, io
+    >>> sniff_codec(io.BytesIO(gzip.compress(b"{}")))[0]
+    'gzip'
+    >>> sniff_codec(io.BytesIO(b"{}")) is None
+    True
+    """
+    if hasattr(f, "peek"):
+        head = f.peek(8)[:8]
+    else:
+        pos = f.tell()
+        head = f.read(8)
+        f.seek(pos)
+    for name, magic, opener in CODECS:
+        if head.startswith(magic):
+            return name, opener
+
+
+def decompressed(f):
+    """Decompressing view of a binary stream, or the stream itself"""
+    codec = sniff_codec(f)
+    return codec[1](f) if codec else f
+
+
+def is_compressed(fn):
+    """
+    Is the file compressed with any of the registered codecs
+
+    >>> import bz2, tempfile
+    >>> with tempfile.NamedTemporaryFile() as tmpfile:
+    ...     tmpfile.write(bz2.compress(b"{}")) and True
+    ...     tmpfile.flush()
+    ...     is_compressed(tmpfile.name)
+    True
+    True
+    """
+    with open(fn, "rb") as f:
+        return sniff_codec(f) is not None
+
+
+class DecompressedStream:
+    """Binary stream that decompresses the raw stream if needed"""
+
+    def __init__(self, raw, closing=None):
+        self.raw = raw
+        self.closing = closing
+        try:
+            self.f = decompressed(raw)
+        except Exception:
+            self.close()
+            raise
+        if hasattr(self.f, "read1"):
+            self.read1 = self.f.read1
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if getattr(self, "f", self.raw) is not self.raw:
+            self.f.close()
+        self.raw.close()
+        if self.closing:
+            self.closing.close()
+
+
+def open_compressed(fn):
+    """Open a file for reading, decompressing it if needed"""
+    return DecompressedStream(open(fn, "rb"))
+
+
+_HTTP_SESSION = None
+
+
+def http_session():
     """
-    >>> a = MinimalAdapter()
-    >>> a(iter([b"abcde", b"fghij"])).read(2)
-    'ab'
-    >>> a.read(2)
-    'cd'
-    >>> a.read(2)
-    'ef'
+    Shared requests session, so that all urls reuse pooled connections
+    """
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        _HTTP_SESSION = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        _HTTP_SESSION.mount("http://", adapter)
+        _HTTP_SESSION.mount("https://", adapter)
+    return _HTTP_SESSION
+
+
+def is_http(fn):
+    return fn.startswith(("http://", "https://"))
+
+
+def open_url(url):
+    """Open a streaming http(s) response body, decompressing it if needed"""
+    import io
+
+    response = http_session().get(url, stream=True)
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        # Decompressors may read again after the end of the body
+        response.raw.auto_close = False
+        raw = io.BufferedReader(response.raw, BLOCK_SIZE)
+    except Exception:
+        response.close()
+        raise
+    return DecompressedStream(raw, closing=response)
+
+
+def open_input(fn):
+    """Open a local file or a http(s) url for streaming"""
+    if is_http(fn):
+        return open_url(fn)
+    return open_compressed(fn)
+
+
+def read_blocks(fn, blocksize=BLOCK_SIZE):
+    """
+    Read a possibly compressed file or url in blocks
+
+    >>> import gzip, tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl.gz") as tmpfile:
+    ...     tmpfile.write(gzip.compress(b'{"a": 1}\\n')) and True
+    ...     tmpfile.flush()
+    ...     list(read_blocks(tmpfile.name, 4))
+    True
+    [b'{"a"', b': 1}', b'\\n']
+    """
+    with open_input(fn) as f:
+        yield from read_stream_blocks(f, blocksize)
+
+
+def read_stream_blocks(f, blocksize=BLOCK_SIZE):
+    """Read a binary stream in blocks, returning short reads as they come"""
+    read = getattr(f, "read1", f.read)
+    while True:
+        block = read(blocksize)
+        if not block:
+            return
+        yield block
+
+
+class FilePrefetcher:
+    """
+    Read and decompress files or urls ahead of the consumer in background threads
+
+    At most `ahead` files are read at the same time and each of them buffers
+    at most `maxblocks` blocks. zlib and bz2 release the GIL while
+    decompressing, so reading overlaps with parsing in the consumer.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     fns = [f"{tmpdir}/{i}.jsonl" for i in range(3)]
+    ...     for i, fn in enumerate(fns):
+    ...         with open(fn, "wb") as f:
+    ...             _ = f.write(b'{"a": %d}\\n' % i)
+    ...     with FilePrefetcher(fns, ahead=2) as prefetcher:
+    ...         [b"".join(prefetcher.blocks(i)) for i in range(3)]
+    [b'{"a": 0}\\n', b'{"a": 1}\\n', b'{"a": 2}\\n']
     """
 
+    END = object()
+
+    def __init__(self, files, ahead=2, blocksize=BLOCK_SIZE, maxblocks=8):
+        import threading
+
+        self.files = list(files)
+        self.ahead = max(ahead, 1)
+        self.blocksize = blocksize
+        self.maxblocks = maxblocks
+        self.stop = threading.Event()
+        self.queues = {}
+        self.started = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.stop.set()
+
+    def _put(self, q, item):
+        from queue import Full
+
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _read(self, idx, q):
+        try:
+            for block in read_blocks(self.files[idx], self.blocksize):
+                if not self._put(q, (idx, block)):
+                    return
+        except Exception as ex:
+            self._put(q, (idx, ex))
+            return
+        self._put(q, (idx, self.END))
+
+    def _start(self, idx, q):
+        import threading
+
+        threading.Thread(target=self._read, args=(idx, q), daemon=True).start()
+        self.started = max(self.started, idx + 1)
+
+    def _get(self, q):
+        idx, block = q.get()
+        if isinstance(block, Exception):
+            raise block
+        return idx, block
+
+    def blocks(self, idx):
+        """Blocks of file number idx. Files must be consumed in order."""
+        from queue import Queue
+
+        while self.started < min(idx + self.ahead, len(self.files)):
+            q = Queue(self.maxblocks)
+            self.queues[self.started] = q
+            self._start(self.started, q)
+        q = self.queues.pop(idx)
+        while True:
+            _, block = self._get(q)
+            if block is self.END:
+                return
+            yield block
+
+    def interleaved(self):
+        """(file number, block) pairs of all files in the order they are read"""
+        from queue import Queue
+
+        q = Queue(self.maxblocks * self.ahead)
+        running = 0
+        while self.started < min(self.ahead, len(self.files)):
+            self._start(self.started, q)
+            running += 1
+        while running:
+            idx, block = self._get(q)
+            if block is self.END:
+                running -= 1
+                if self.started < len(self.files):
+                    self._start(self.started, q)
+                    running += 1
+                continue
+            yield idx, block
+
+
+class _Feed:
+    """Chunk iterator that can be refilled after it has run dry"""
+
     def __init__(self):
-        self._fip = None
-        self._buf = None  # storage of read but unused material, maximum one line
+        from collections import deque
 
-    def __call__(self, fip):
-        self._fip = fip  # store for future use
-        self._buf = ""
+        self.chunks = deque()
+
+    def __iter__(self):
         return self
 
-    def read(self, size):
-        if len(self._buf) >= size:
-            # enough in buffer from last read, just cut it off and return
-            tmp, self._buf = self._buf[:size], self._buf[size:]
-            return tmp
-        for line in self._fip:
-            self._buf += line.decode()
-            if len(self._buf) > size:
-                break
+    def __next__(self):
+        if self.chunks:
+            return self.chunks.popleft()
+        raise StopIteration
+
+
+def yield_interleaved_json(prefetcher, loads=None):
+    """
+    Yield json items of all prefetched files as soon as they are read
+
+    Every file has its own splitter, so records are never mixed, but the
+    order of records between files is not preserved.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     fns = [f"{tmpdir}/{i}.jsonl" for i in range(3)]
+    ...     for i, fn in enumerate(fns):
+    ...         with open(fn, "wb") as f:
+    ...             _ = f.write(b'{"a": %d}\\n{"b": %d}\\n' % (i, i))
+    ...     with FilePrefetcher(fns, blocksize=5) as prefetcher:
+    ...         items = list(yield_interleaved_json(prefetcher))
+    >>> sorted(map(repr, items))
+    ["{'a': 0}", "{'a': 1}", "{'a': 2}", "{'b': 0}", "{'b': 1}", "{'b': 2}"]
+    """
+    feeds = {}
+    splitters = {}
+    for idx, block in prefetcher.interleaved():
+        if idx not in feeds:
+            feeds[idx] = _Feed()
+            splitters[idx] = yield_json_and_json_lines(
+                feeds[idx], parse=True, loads=loads
+            )
+        feeds[idx].chunks.append(block)
+        yield from splitters[idx]
+
+
+COMPRESSED_JSON_EXT = ("json", "jsonl", "gz", "bz2", "xz", "zst", "zstd", "lz4")
+
+
+def is_prefetchable(fn, inputfmt=None):
+    """
+    Is the file a json file or url that the prefetcher can read
+
+    >>> is_prefetchable("logs/a.jsonl.gz"), is_prefetchable("a.csv"), is_prefetchable("s3://a/b.json")
+    (True, False, False)
+    >>> is_prefetchable("https://host/a.json")
+    True
+    """
+    fmt = (inputfmt or fn.split(".")[-1]).split(",")[0]
+    return ("://" not in fn or is_http(fn)) and fmt in COMPRESSED_JSON_EXT
+
+
+def try_json_loads(it):
+    try:
+        return json.loads(it)
+    except Exception as ex:
+        pass
+
+
+def _compose_yaml(loader, anchors):
+    """Compose the next node from the event stream of a yaml loader"""
+    import yaml
+
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        return anchors[event.anchor]
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_compose_yaml(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _compose_yaml(loader, anchors)
+            node.value.append((key, _compose_yaml(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    else:
+        raise yaml.YAMLError(f"Unexpected yaml event {event}")
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def yield_yaml(f, split_sequence=True):
+    """Yield yaml documents as they are parsed
+
+    Every document of a multi-document stream is yielded separately and,
+    with split_sequence, the items of a top-level sequence are yielded one
+    by one, so only one item is held in memory at a time. The C loader is
+    used when libyaml is available.
+
+    >>> from io import BytesIO
+    >>> list(yield_yaml(BytesIO(b"- a: 1\\n- &x {b: 2}\\n- *x\\n")))
+    [{'a': 1}, {'b': 2}, {'b': 2}]
+    >>> list(yield_yaml(BytesIO(b"a: 1\\n---\\na: 2\\n---\\n[1, 2]\\n"), split_sequence=False))
+    [{'a': 1}, {'a': 2}, [1, 2]]
+    """
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)(f)
+    try:
+        loader.get_event()  # StreamStartEvent
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            anchors = {}
+            if split_sequence and loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(_compose_yaml(loader, anchors))
+                loader.get_event()
+            else:
+                yield loader.construct_document(_compose_yaml(loader, anchors))
+            loader.get_event()  # DocumentEndEvent
+    finally:
+        loader.dispose()
+
+
+CHUNK_ROWS = 10000
+
+
+def _parquet_filter(schema, filters):
+    """
+    pyarrow expression for the (field, op, value) filters that fit the schema
+
+    Filters on missing fields or on columns whose type does not match the
+    literal are dropped, since the query evaluates its filters again anyway.
+
+    pyarrow is not a test dependency, so the examples are not run.
+
+    >>> import pyarrow  # doctest: +SKIP
+    >>> schema = pyarrow.schema([("a", pyarrow.int64()), ("b", pyarrow.string())])  # doctest: +SKIP
+    >>> _parquet_filter(schema, [("a", ">", 1), ("b", "==", 2), ("c", "==", 3)])  # doctest: +SKIP
+    <pyarrow.compute.Expression (a > 1)>
+    >>> _parquet_filter(schema, [("b", "==", 2)]) is None  # doctest: +SKIP
+    True
+    """
+    import pyarrow
+    import pyarrow.parquet as pq
+
+    to_expression = getattr(pq, "filters_to_expression", None) or getattr(
+        pq, "_filters_to_expression", None
+    )
+    if to_expression is None:
+        return None
+
+    def fits(typ, value):
+        if isinstance(value, list):
+            return bool(value) and all(fits(typ, v) for v in value)
+        if isinstance(value, bool):
+            return pyarrow.types.is_boolean(typ)
+        if isinstance(value, (int, float)):
+            return pyarrow.types.is_integer(typ) or pyarrow.types.is_floating(typ)
+        return pyarrow.types.is_string(typ) or pyarrow.types.is_large_string(typ)
+
+    usable = [
+        (field, op, value)
+        for field, op, value in filters
+        if schema.get_field_index(field) >= 0
+        and fits(schema.field(field).type, value)
+    ]
+    if not usable:
+        return None
+    return to_expression(usable)
+
+
+def _yield_parquet(fn, chunksize, columns=None, filters=None):
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(fn)
+    # The index of a DataFrame is stored as columns, which read_parquet
+    # turns back into the index
+    metadata = pf.schema_arrow.pandas_metadata or {}
+    index = {c for c in metadata.get("index_columns", []) if isinstance(c, str)}
+    if index:
+        names = pf.schema_arrow.names if columns is None else columns
+        columns = [name for name in names if name not in index]
+    expression = _parquet_filter(pf.schema_arrow, filters) if filters else None
+    if expression is not None:
+        # Scanning through pyarrow.dataset skips row groups whose statistics
+        # can not match the filter
+        import pyarrow.dataset
+
+        batches = pyarrow.dataset.dataset(fn, format="parquet").to_batches(
+            columns=columns, filter=expression, batch_size=chunksize
+        )
+    else:
+        batches = pf.iter_batches(batch_size=chunksize, columns=columns)
+    for batch in batches:
+        if hasattr(batch, "to_pylist"):
+            yield from batch.to_pylist()
         else:
-            # ran out of lines, return what we have
-            tmp, self._buf = self._buf, ""
-            return tmp
-        tmp, self._buf = self._buf[:size], self._buf[size:]
-        return tmp
+            yield from batch.to_pandas().to_dict(orient="records")
 
 
-def get_handler(method, fntype, additionals):
-    fnname = f"jf_{fntype}_{method}"
-    for mod, it in additionals.items():
-        if any([x == fnname for x in dir(it)]):
-            return getattr(it, fnname)
+def _existing_columns(fn, inputfmt, columns):
+    """Requested columns that exist in a columnar file, in file order"""
+    if inputfmt == "parquet":
+        import pyarrow.parquet as pq
 
+        names = pq.ParquetFile(fn).schema_arrow.names
+    elif inputfmt == "feather":
+        import pyarrow.ipc
 
-def fetch_http(url):
-    import requests
+        names = pyarrow.ipc.open_file(fn).schema.names
+    elif inputfmt == "orc":
+        import pyarrow.orc
 
-    return lambda url: requests.get(url).content
+        names = pyarrow.orc.ORCFile(fn).schema.names
+    else:
+        raise NotImplementedError(inputfmt)
+    return [name for name in names if name in columns]
 
 
-def fetch_https(url):
-    import requests
+def _yield_xlsx(fn, sheet_name=0, columns=None):
+    import openpyxl
 
-    return lambda url: requests.get(url).content
+    wb = openpyxl.load_workbook(fn, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet_name] if isinstance(sheet_name, int) else wb[sheet_name]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [
+            h if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)
+        ]
+        if columns is not None:
+            idx = [i for i, h in enumerate(header) if h in columns]
+            header = [header[i] for i in idx]
+            for row in rows:
+                yield {h: row[i] if i < len(row) else None for h, i in zip(header, idx)}
+            return
+        for row in rows:
+            yield dict(zip(header, row))
+    finally:
+        wb.close()
+
+
+def yield_pandas(
+    fn, inputfmt, inputkwargs={}, chunksize=CHUNK_ROWS, columns=None, filters=None
+):
+    """Yield records of a file in a pandas supported format
+
+    Formats that can be read incrementally are read in chunks of chunksize
+    rows, so records are yielded as soon as the first chunk is decoded and
+    memory stays bounded: csv, fwf, sas and stata through the chunked pandas
+    readers, parquet by record batches and xlsx through openpyxl read-only
+    mode. Other formats are read into one DataFrame.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".csv") as tmpfile:
+    ...     tmpfile.write(b"a,b\\n1,x\\n2,y\\n3,z\\n") and True
+    ...     tmpfile.flush()
+    ...     list(yield_pandas(tmpfile.name, "csv", chunksize=2))
+    True
+    [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}, {'a': 3, 'b': 'z'}]
+    >>> with tempfile.NamedTemporaryFile(suffix=".csv") as tmpfile:
+    ...     tmpfile.write(b"a,b\\n1,x\\n") and True
+    ...     tmpfile.flush()
+    ...     list(yield_pandas(tmpfile.name, "csv", columns={"b", "c"}))
+    True
+    [{'b': 'x'}]
+
+    Parquet needs pyarrow, which is not a test dependency:
+
+    >>> import pandas
+    >>> with tempfile.NamedTemporaryFile(suffix=".parquet") as tmpfile:  # doctest: +SKIP
+    ...     pandas.DataFrame({"a": [1, 2, 3]}).to_parquet(tmpfile.name)
+    ...     list(yield_pandas(tmpfile.name, "parquet", filters=[("a", ">", 1)]))
+    [{'a': 2}, {'a': 3}]
+    >>> with tempfile.NamedTemporaryFile(suffix=".parquet") as tmpfile:  # doctest: +SKIP
+    ...     df = pandas.DataFrame({"a": [1]}, index=pandas.Index(["x"], name="k"))
+    ...     df.to_parquet(tmpfile.name)
+    ...     list(yield_pandas(tmpfile.name, "parquet"))
+    [{'a': 1}]
+    """
+    import pandas
+
+    pandas_fmt_map = {"xlsx": "excel"}
+    inputkwargs = dict(inputkwargs)
+    chunksize = int(inputkwargs.pop("chunksize", chunksize))
+    if inputfmt == "tsv":
+        inputfmt, inputkwargs = "csv", dict({"sep": "\t"}, **inputkwargs)
+    if columns is not None and "usecols" not in inputkwargs:
+        if "columns" not in inputkwargs:
+            if inputfmt in ("csv", "fwf"):
+                inputkwargs["usecols"] = lambda c: c in columns
+            elif inputfmt in ("parquet", "feather", "orc"):
+                try:
+                    inputkwargs["columns"] = _existing_columns(fn, inputfmt, columns)
+                except (ImportError, OSError, TypeError):
+                    pass
+            elif inputfmt == "xlsx" and set(inputkwargs) <= {"sheet_name"}:
+                try:
+                    import openpyxl
+                except ImportError:
+                    pass
+                else:
+                    yield from _yield_xlsx(fn, columns=columns, **inputkwargs)
+                    return
+    if "iterator" not in inputkwargs:
+        if inputfmt in ("csv", "fwf", "sas", "stata"):
+            reader = getattr(pandas, f"read_{inputfmt}")(
+                fn, chunksize=chunksize, **inputkwargs
+            )
+            try:
+                if not hasattr(fn, "ready"):
+                    for df in reader:
+                        yield from df.to_dict(orient="records")
+                    return
+                # A stream waits for the rows of a chunk. While it has no
+                # more data ready, rows are read one at a time so they are
+                # yielded as they arrive, and chunks grow when data is
+                # ready.
+                size = 1
+                while True:
+                    try:
+                        df = reader.get_chunk(size)
+                    except StopIteration:
+                        break
+                    yield from df.to_dict(orient="records")
+                    size = min(2 * size, chunksize) if fn.ready() else 1
+            finally:
+                if hasattr(reader, "close"):
+                    reader.close()
+            return
+        if inputfmt == "parquet" and set(inputkwargs) <= {"columns"}:
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                pass
+            else:
+                # Older pyarrow can not read record batches
+                if hasattr(pyarrow.parquet.ParquetFile, "iter_batches"):
+                    yield from _yield_parquet(
+                        fn, chunksize, filters=filters, **inputkwargs
+                    )
+                    return
+        if inputfmt == "xlsx" and set(inputkwargs) <= {"sheet_name"}:
+            try:
+                import openpyxl
+            except ImportError:
+                pass
+            else:
+                yield from _yield_xlsx(fn, **inputkwargs)
+                return
+
+    df = getattr(pandas, f"read_{pandas_fmt_map.get(inputfmt, inputfmt)}")(
+        fn, **inputkwargs
+    )
+    yield from df.to_dict(orient="records")
+
+
+def yield_msgpack(f):
+    """Yield the objects of a msgpack stream as they are unpacked
+
+    msgpack is not a test dependency, so the example is not run.
+
+    >>> import msgpack  # doctest: +SKIP
+    >>> from io import BytesIO
+    >>> list(yield_msgpack(BytesIO(msgpack.packb({"a": 1}) + msgpack.packb([2]))))  # doctest: +SKIP
+    [{'a': 1}, [2]]
+    """
+    import msgpack
+
+    yield from msgpack.Unpacker(f, raw=False)
+
+
+STREAM_FORMATS = ("csv", "tsv", "yaml", "yml", "msgpack")
+
+
+def is_streamed(inputfmt, additionals):
+    """
+    Is the format read by yield_stream
+
+    A registered unserialize handler for msgpack replaces the built-in
+    reader.
+
+    >>> is_streamed("msgpack", {}), is_streamed("xlsx", {})
+    (True, False)
+    """
+    if inputfmt == "msgpack":
+        return get_handler(inputfmt, "unserialize", additionals) is None
+    return inputfmt in STREAM_FORMATS
+
+
+class ShortReads:
+    """
+    Stream whose read returns what is available instead of waiting for size
+
+    Parsers reading from a pipe can then emit records as soon as the
+    producer writes them.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self._read = getattr(f, "read1", f.read)
+
+    def read(self, size=-1):
+        return self._read(size if size and size > 0 else BLOCK_SIZE)
+
+    def ready(self):
+        """Can more be read without waiting for the producer"""
+        import select
+
+        try:
+            return bool(select.select([self.f.fileno()], [], [], 0)[0])
+        except (AttributeError, OSError, ValueError):
+            return True
+
+    def __iter__(self):
+        return iter(self.f)
+
+    def readline(self, *args):
+        return self.f.readline(*args)
+
+
+def yield_stream(f, inputfmt, inputkwargs={}, columns=None):
+    """Yield records of a binary stream in a format that can be streamed
+
+    >>> from io import BytesIO
+    >>> list(yield_stream(BytesIO(b"a\\tb\\n1\\t2\\n"), "tsv"))
+    [{'a': 1, 'b': 2}]
+    >>> list(yield_stream(BytesIO(b"a: 1\\n---\\na: 2\\n"), "yaml"))
+    [{'a': 1}, {'a': 2}]
+    """
+    if inputfmt in ("csv", "tsv"):
+        yield from yield_pandas(f, inputfmt, inputkwargs, columns=columns)
+    elif inputfmt in ("yaml", "yml"):
+        yield from yield_yaml(f)
+    elif inputfmt == "msgpack":
+        yield from yield_msgpack(f)
+    else:
+        raise NotImplementedError(f"{inputfmt} can not be streamed")
+
+
+def parse_inputfmt(inputfmt):
+    """
+    Split input format and its reader arguments
+
+    >>> parse_inputfmt("csv,sep=;,header=1")
+    ('csv', {'sep': ';', 'header': '1'})
+    """
+    inputfmt = inputfmt.split(",", 1)
+    inputfmt, inputkwargs = (
+        inputfmt[0],
+        inputfmt[1] if len(inputfmt) == 2 else "",
+    )
+    inputkwargs = (
+        dict([it.split("=") for it in inputkwargs.split(",")])
+        if len(inputkwargs)
+        else {}
+    )
+    return inputfmt, inputkwargs
+
+
+def get_handler(method, fntype, additionals):
+    """
+    Registered jf_<fntype>_<method> handler, also from modules in additionals
+
+    Only modules are scanned for handlers, and each of them once.
+    """
+    import types
+
+    for it in additionals.values():
+        if isinstance(it, types.ModuleType):
+            register_module(it)
+    return lookup(fntype, method)
+
+
+@register("fetch", "http", "https")
+def fetch_http(url):
+    def _fetch(url, f):
+        with http_session().get(url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(BLOCK_SIZE):
+                f.write(chunk)
+
+    return _fetch
 
 
 def fetch_file(fn, f, additionals):
     """
     Fetch file with custom handler
 
+    >>> import types
     >>> from io import StringIO
     >>> s = StringIO()
-    >>> class fetch_mod:
-    ...     def jf_fetch_s3(m):
-    ...          return '{"hello": "world"}'
+    >>> fetch_mod = types.ModuleType("fetch_mod")
+    >>> fetch_mod.jf_fetch_s3 = lambda m: '{"hello": "world"}'
     >>> fetch_file("s3://bucket/key.json", s, {"mod": fetch_mod})
     >>> s.getvalue()
     '{"hello": "world"}'
+    >>> from jf.meta import REGISTRY
+    >>> del REGISTRY["fetch"]["s3"]
     """
-    from itertools import chain
-
     proto = fn.split("://")[0]
-    try:
-        fun = globals()[f"fetch_{proto}"](fn)
-    except Exception as ex:
-        fun = get_handler(proto, "fetch", additionals)
+    fun = get_handler(proto, "fetch", additionals)
     if fun:
-        f.write(fun(fn))
+        body = fun(fn)
+        if callable(body):
+            # Built in fetchers stream the body into f
+            body(fn, f)
+        else:
+            f.write(body)
         return
     raise NotImplementedError(
         f"I do not know how to fetch {proto}://.\nPlease implement {proto}(url) -> bytes and import a module with it with --import"
     )
 
 
-def data_input(files=None, additionals={}, inputfmt=None, listen=None):
+def data_input(
+    files=None,
+    additionals={},
+    inputfmt=None,
+    listen=None,
+    prefetch=2,
+    interleave=False,
+    columns=None,
+    filters=None,
+    lazy=False,
+    raw=False,
+):
     """
     Data input function
 
+    columns is the set of top-level fields the query reads (see
+    query_parser.query_fields). Columnar readers then skip all other fields.
+    filters are (field, op, value) tuples that every record the query keeps
+    satisfies (see query_parser.query_filters). Parquet files skip row groups
+    and rows that do not satisfy them.
+    With lazy set, json objects are read as LazyRecords that decode only the
+    fields that are accessed. With raw set, json and json lines items are
+    yielded as bytes for worker processes to parse (see process.RawRecords).
+
     >>> import tempfile
     >>> with tempfile.NamedTemporaryFile() as tmpfile:
     ...     tmpfile.write(b'[{"myconfig": "myvalue"}]') and True
@@ -123,17 +1369,34 @@ def data_input(files=None, additionals={}, inputfmt=None, listen=None):
     ...     len(list(data_input([tmpfile.name])))
     True
     2
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as f1, tempfile.NamedTemporaryFile(suffix=".jsonl") as f2:
+    ...     f1.write(b'{"a": 1}') and f2.write(b'{"a": 2}') and True
+    ...     f1.flush(); f2.flush()
+    ...     list(data_input([f1.name, f2.name]))
+    True
+    [{'a': 1}, {'a': 2}]
+    >>> import types
+    >>> mod = types.ModuleType("mod")
+    >>> mod.jf_unserialize_msgpack = lambda f: [{"size": len(f.read())}]
+    >>> with tempfile.NamedTemporaryFile(suffix=".msgpack") as tmpfile:
+    ...     tmpfile.write(b"abc") and True
+    ...     tmpfile.flush()
+    ...     list(data_input([tmpfile.name], {"mod": mod}))
+    True
+    [{'size': 3}]
+    >>> from jf.meta import REGISTRY
+    >>> del REGISTRY["unserialize"]["msgpack"]
     >>> list(data_input(["nots3://bucket/key.json"], {}))
     Traceback (most recent call last):
     ...
     NotImplementedError: ...
     """
-    import fileinput
     import json
     import sys
 
     pandas_ext = (
         "csv",
+        "tsv",
         "xlsx",
         "feather",
         "fwf",
@@ -151,45 +1414,91 @@ def data_input(files=None, additionals={}, inputfmt=None, listen=None):
     )
     pandas_fmt_map = {"xlsx": "excel"}
 
-    def try_json_loads(it):
-        try:
-            return json.loads(it)
-        except Exception as ex:
-            pass
-
     tmpf = None
     if not files:
         if listen:
             return int(listen)
         if inputfmt is None or inputfmt.startswith("json"):
             yield from filter(
-                lambda x: x, map(try_json_loads, yield_json_and_json_lines(sys.stdin))
+                lambda x: x,
+                yield_json_and_json_lines(
+                    read_stream_blocks(decompressed(sys.stdin.buffer)),
+                    as_bytes=raw,
+                    parse=not raw,
+                    loads=try_json_loads,
+                    lazy=lazy,
+                ),
+            )
+            return
+        stdinfmt, stdinkwargs = parse_inputfmt(inputfmt)
+        if is_streamed(stdinfmt, additionals):
+            yield from yield_stream(
+                ShortReads(decompressed(sys.stdin.buffer)),
+                stdinfmt,
+                stdinkwargs,
+                columns=columns,
             )
             return
         else:
+            # Formats that need a seekable file are spooled to disk
+            import shutil
             from tempfile import NamedTemporaryFile
 
             tmpf = NamedTemporaryFile(
-                suffix=f".{pandas_fmt_map.get(inputfmt, inputfmt)}", delete=False
+                suffix=f".{pandas_fmt_map.get(stdinfmt, stdinfmt)}", delete=False
             )
-            for line in sys.stdin:
-                tmpf.write(line.encode())
+            shutil.copyfileobj(sys.stdin.buffer, tmpf)
             tmpf.close()
             files = [tmpf.name]
 
+    # Read and decompress upcoming json files in the background
+    prefetcher = None
+    prefetched = {}
+    if (prefetch or interleave) and len(files) > 1:
+        for fn in files:
+            if fn not in prefetched and is_prefetchable(fn, inputfmt):
+                # Interleaving reads all files through the prefetcher, also
+                # the ones that would be memory mapped
+                if interleave or not use_mmap(fn):
+                    prefetched[fn] = len(prefetched)
+        prefetcher = FilePrefetcher(prefetched, ahead=prefetch)
+        if interleave:
+            if len(prefetched) == len(set(files)) == len(files):
+                try:
+                    yield from yield_interleaved_json(
+                        prefetcher, loads=try_json_loads
+                    )
+                finally:
+                    prefetcher.close()
+                return
+            sys.stderr.write(
+                "--interleave needs json inputs that are each given once, "
+                "reading the files in order\n"
+            )
+
     try:
         for fn in files:
             inputfmt = fn.split(".")[-1] if inputfmt is None else inputfmt
-            inputfmt = inputfmt.split(",", 1)
-            inputfmt, inputkwargs = (
-                inputfmt[0],
-                inputfmt[1] if len(inputfmt) == 2 else "",
-            )
-            inputkwargs = (
-                dict([it.split("=") for it in inputkwargs.split(",")])
-                if len(inputkwargs)
-                else {}
-            )
+            inputfmt, inputkwargs = parse_inputfmt(inputfmt)
+            if is_http(fn) and is_streamed(inputfmt, additionals):
+                with open_url(fn) as f:
+                    yield from yield_stream(
+                        ShortReads(f), inputfmt, inputkwargs, columns=columns
+                    )
+                continue
+            if is_http(fn) and not inputfmt in pandas_ext + STREAM_FORMATS:
+                if fn in prefetched:
+                    blocks = prefetcher.blocks(prefetched.pop(fn))
+                else:
+                    blocks = read_blocks(fn)
+                yield from yield_json_and_json_lines(
+                    blocks,
+                    as_bytes=raw,
+                    parse=not raw,
+                    loads=try_json_loads,
+                    lazy=lazy,
+                )
+                continue
             if "://" in fn:
                 from tempfile import NamedTemporaryFile
 
@@ -201,24 +1510,15 @@ def data_input(files=None, additionals={}, inputfmt=None, listen=None):
                 tmpf.close()
                 fn = tmpf.name
             if inputfmt in pandas_ext:
-                import pandas
-
-                df = getattr(pandas, f"read_{pandas_fmt_map.get(inputfmt, inputfmt)}")(
-                    fn, **inputkwargs
+                yield from yield_pandas(
+                    fn, inputfmt, inputkwargs, columns=columns, filters=filters
                 )
-                for it in df.to_dict(orient="records"):
-                    yield it
                 continue
-            if inputfmt in ("yml", "yaml"):
-                import yaml
-
-                ma = MinimalAdapter()
-                with fileinput.input(fn, mode="rb") as f:
-                    ret = yaml.safe_load(ma(f))
-                    if isinstance(ret, list):
-                        yield from ret
-                    else:
-                        yield ret
+            if inputfmt in ("yml", "yaml", "msgpack") and is_streamed(
+                inputfmt, additionals
+            ):
+                with open_compressed(fn) as f:
+                    yield from yield_stream(f, inputfmt)
                 continue
             if not inputfmt in ("json", "jsonl"):
                 fun = get_handler(fn.split(".")[-1], "unserialize", additionals)
@@ -227,21 +1527,33 @@ def data_input(files=None, additionals={}, inputfmt=None, listen=None):
                         yield from fun(f)
                         continue
 
-            import os
-
-            ext = os.path.splitext(fn)[1]
-            with fileinput.input(
-                fn,
-                openhook=(fileinput.hook_compressed if ext in ("bz2", "gz") else None),
-                mode="rb",
-            ) as f:
-                yield from map(
-                    try_json_loads,
-                    yield_json_and_json_lines(map(lambda x: x.decode(), f)),
+            if use_mmap(fn):
+                yield from yield_mmap_json(
+                    fn, loads=try_json_loads, lazy=lazy, raw=raw
+                )
+                continue
+            if fn in prefetched:
+                yield from yield_json_and_json_lines(
+                    prefetcher.blocks(prefetched.pop(fn)),
+                    as_bytes=raw,
+                    parse=not raw,
+                    loads=try_json_loads,
+                    lazy=lazy,
                 )
+                continue
+
+            yield from yield_json_and_json_lines(
+                read_blocks(fn),
+                as_bytes=raw,
+                parse=not raw,
+                loads=try_json_loads,
+                lazy=lazy,
+            )
     except Exception as ex:
         raise ex
     finally:
+        if prefetcher:
+            prefetcher.close()
         if tmpf:
             import os
 
@@ -320,7 +1632,6 @@ def get_supported_formats():
     """
     import pandas as pd
 
-    df = pd.DataFrame([{"a": 1}])
     SUPPORT_EXCLUDE = {
         "timestamp",
         "hdf",
@@ -334,7 +1645,7 @@ def get_supported_formats():
     return set(
         [
             it[3:]
-            for it in dir(df)
+            for it in dir(pd.DataFrame)
             if it.startswith("to_")
             if not it[3:] in SUPPORT_EXCLUDE
         ]
@@ -342,14 +1653,6 @@ def get_supported_formats():
     )
 
 
-def not_dotaccessible(it):
-    if isinstance(it, dict):
-        return {k: not_dotaccessible(v) for k, v in dict.items(it)}
-    if isinstance(it, list):
-        return [not_dotaccessible(v) for v in it]
-    return it
-
-
 class StructEncoder(json.JSONEncoder):
     """
     Try to convert everything to json
@@ -361,14 +1664,42 @@ class StructEncoder(json.JSONEncoder):
     """
 
     def default(self, obj):
-        if isinstance(obj, DotAccessible):
-            obj = {k: v for k, v in dict.items(obj)}
+        if isinstance(obj, DotAccessibleNone):
+            return None
         try:
             return super().default(obj)
         except:
             return str(obj)
 
 
+def dump_json(it, compact=False):
+    """
+    Serialize an item for json output
+
+    Wrapped and lazy records are serialized as they are, without copies.
+
+    >>> print(dump_json({"a": [1]}, compact=True))
+    {"a": [1]}
+    >>> print(dump_json(LazyRecord(b'{"a": {"b": null}}'), compact=True))
+    {"a": {"b": null}}
+    >>> print(dump_json({"a": DotAccessibleNone()}, compact=True))
+    {"a": null}
+    >>> print(dump_json(LazyRecord(b'{"items": [1]}'), compact=True))
+    {"items": [1]}
+    """
+    kwargs = {} if compact else {"indent": 2}
+    try:
+        return json.dumps(
+            materialize_lazy(it), ensure_ascii=False, cls=StructEncoder, **kwargs
+        )
+    except TypeError:
+        # The encoder calls .items(), which records with a field of that
+        # name answer with the field
+        return json.dumps(
+            undotaccessible(it), ensure_ascii=False, cls=StructEncoder, **kwargs
+        )
+
+
 def print_results(ret, output, compact=False, raw=False, additionals={}):
     """
     Print array with various formats
@@ -397,20 +1728,19 @@ def print_results(ret, output, compact=False, raw=False, additionals={}):
     <BLANKLINE>
     >>> print_results(data, 'pickle')
     <bytes>
-    >>> class serialize_mod:
-    ...     def jf_serialize_msg(m):
-    ...          return repr(m)
+    >>> import types
+    >>> serialize_mod = types.ModuleType("serialize_mod")
+    >>> serialize_mod.jf_serialize_msg = repr
     >>> print_results(data, 'msg', additionals={"mod": serialize_mod})
     <bytes>
+    >>> from jf.meta import REGISTRY
+    >>> del REGISTRY["serialize"]["msg"]
     >>> print_results(data, 'not supported')
     Traceback (most recent call last):
     ...
     NotImplementedError: Cannot output not supported yet. Please consider making a PR!
     """
     import sys
-    from pygments.lexers import get_lexer_by_name
-    from pygments import highlight
-    from pygments.formatters import TerminalFormatter
 
     if output == "yaml":
         import yaml
@@ -421,17 +1751,19 @@ def print_results(ret, output, compact=False, raw=False, additionals={}):
         return
 
     _highligh = None
-    try:
-        formatter = TerminalFormatter()
-        lexertype = output if output != "jsonl" else "json"
-        output_kwargs = {}
-        if not compact:
-            output_kwargs["indent"] = 2
-        if sys.stdout.isatty():
+    if sys.stdout.isatty():
+        # Highlighting is only needed on a terminal, and pygments is slow to import
+        try:
+            from pygments.lexers import get_lexer_by_name
+            from pygments import highlight
+            from pygments.formatters import TerminalFormatter
+
+            formatter = TerminalFormatter()
+            lexertype = output if output != "jsonl" else "json"
             lexer = get_lexer_by_name(lexertype, stripall=True)
             _highligh = lambda line: highlight(line, lexer, formatter).rstrip()
-    except:
-        pass
+        except:
+            pass
     ret = iter(ret)
     if output == "yaml":
         ret = list(ret)
@@ -445,16 +1777,18 @@ def print_results(ret, output, compact=False, raw=False, additionals={}):
 
     for line in ret:
         out = line
+        if isinstance(line, SerializedLines):
+            # Already serialized by a worker process
+            if hasattr(sys.stdout, "buffer"):
+                sys.stdout.flush()
+                sys.stdout.buffer.write(line)
+            else:
+                sys.stdout.write(line.decode())
+            continue
         if output in ("python", "py"):
             line = repr(line)
         elif output in ("json", "jsonl"):
-            line = json.dumps(
-                not_dotaccessible(line),
-                ensure_ascii=False,
-                cls=StructEncoder,
-                **output_kwargs
-                # not_dotaccessible(line), ensure_ascii=False, cls=StructEncoder, **output_kwargs
-            )
+            line = dump_json(line, compact)
         else:
             alldata = [line] + list(ret)
             fun = get_handler(output, "serialize", additionals)
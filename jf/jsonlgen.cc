@@ -1,8 +1,10 @@
-#include <Python.h> 
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <cstring>
+#include <new>
 #include <string>
 #include <iostream>
 #include <sstream>
-#include <queue>
 #include <vector>
 
 #define DEBUG (0)
@@ -12,29 +14,485 @@ using namespace std;
 typedef struct {
     PyObject_HEAD
     PyObject *iter;
-    queue<string> items;
-    vector<char> data;
+    PyObject *chunk;        /* chunk currently being scanned, NULL if none */
+    Py_buffer view;         /* buffer of chunk, unless it is a str */
+    const char *buf;
+    Py_ssize_t len;
+    Py_ssize_t off = 0;     /* scan position in buf */
+    vector<char> data;      /* head of an item that started in an earlier chunk */
+    bool as_bytes = 0;
+    bool parse = 0;
+    PyObject *loads;        /* fallback for items the fast parser does not handle */
+    PyObject *memo;         /* shared dict keys */
     bool quote = 0;
     bool escape = 0;
     uint8_t obj = 0;
     uint8_t list = 0;
-    int item = -1;
-    int pos = -1;
+    char itemtype = 0;      /* first character of the current item, 0 if none */
+    Py_ssize_t item = -1;   /* start of the current item in the chunk, -1 if in data */
 } JSONLgenState;
 
+/* Capacity kept for the item head buffer between items. A buffer grown by a
+ * huge item is released once that item has been emitted.
+ */
+#define DATA_KEEP (1 << 20)
+
+static void
+releasechunk(JSONLgenState *s)
+{
+    if (!s->chunk)
+        return;
+    if (s->view.obj)
+        PyBuffer_Release(&s->view);
+    Py_CLEAR(s->chunk);
+    s->buf = NULL;
+    s->len = 0;
+    s->off = 0;
+}
+
 static void
 jsonlgen_dealloc(JSONLgenState *jfstate)
 {
+    releasechunk(jfstate);
     Py_XDECREF(jfstate->iter);
+    Py_XDECREF(jfstate->loads);
+    Py_XDECREF(jfstate->memo);
+    jfstate->data.~vector<char>();
     Py_TYPE(jfstate)->tp_free(jfstate);
 }
 
 
-void parsejsonl(string &str, JSONLgenState *s){
-    for(char& c : str){
-        s->pos++;
-        s->data.push_back(c);
-        if(DEBUG) cerr << c << " " << s->quote << s->escape << (int) s->obj << (int) s->list << " " << s->pos << " " << s->data.size() << endl;
+/* Direct json to python object decoding
+ *
+ * Handles the common subset of json: objects, arrays, strings, 64 bit
+ * integers, floats, true, false and null. Anything else (NaN, Infinity, huge
+ * integers, lone surrogates, syntax errors, very deep nesting) makes the
+ * decoder give up with NOFAST set and the item is handed to the loads
+ * fallback as a whole.
+ */
+#define MAX_DEPTH (512)
+#define MEMO_MAX (1 << 16)
+
+typedef struct {
+    const char *p;
+    const char *end;
+    PyObject *memo;
+    int depth;
+    bool nofast;
+} Decoder;
+
+static PyObject *decodevalue(Decoder *d);
+
+static inline PyObject *
+nofast(Decoder *d)
+{
+    d->nofast = 1;
+    return NULL;
+}
+
+static inline void
+skipws(Decoder *d)
+{
+    while (d->p < d->end && (*d->p == ' ' || *d->p == '\n' || *d->p == '\r' || *d->p == '\t'))
+        d->p++;
+}
+
+static int
+hexvalue(const char *p)
+{
+    int v = 0;
+    for (int i = 0; i < 4; i++) {
+        char c = p[i];
+        v <<= 4;
+        if (c >= '0' && c <= '9') v |= c - '0';
+        else if (c >= 'a' && c <= 'f') v |= c - 'a' + 10;
+        else if (c >= 'A' && c <= 'F') v |= c - 'A' + 10;
+        else return -1;
+    }
+    return v;
+}
+
+static void
+pututf8(string &out, Py_UCS4 cp)
+{
+    if (cp < 0x80) {
+        out += (char)cp;
+    } else if (cp < 0x800) {
+        out += (char)(0xc0 | (cp >> 6));
+        out += (char)(0x80 | (cp & 0x3f));
+    } else if (cp < 0x10000) {
+        out += (char)(0xe0 | (cp >> 12));
+        out += (char)(0x80 | ((cp >> 6) & 0x3f));
+        out += (char)(0x80 | (cp & 0x3f));
+    } else {
+        out += (char)(0xf0 | (cp >> 18));
+        out += (char)(0x80 | ((cp >> 12) & 0x3f));
+        out += (char)(0x80 | ((cp >> 6) & 0x3f));
+        out += (char)(0x80 | (cp & 0x3f));
+    }
+}
+
+/* d->p points just after the opening quote */
+static PyObject *
+decodestring(Decoder *d)
+{
+    const char *start = d->p;
+    const char *p = start;
+    while (p < d->end && *p != '"' && *p != '\\') {
+        if ((unsigned char)*p < 0x20)
+            return nofast(d);
+        p++;
+    }
+    if (p >= d->end)
+        return nofast(d);
+    if (*p == '"') {
+        d->p = p + 1;
+        return PyUnicode_DecodeUTF8(start, p - start, NULL);
+    }
+    string out(start, p - start);
+    while (p < d->end && *p != '"') {
+        if ((unsigned char)*p < 0x20)
+            return nofast(d);
+        if (*p != '\\') {
+            out += *p++;
+            continue;
+        }
+        if (++p >= d->end)
+            return nofast(d);
+        switch (*p++) {
+            case '"': out += '"'; break;
+            case '\\': out += '\\'; break;
+            case '/': out += '/'; break;
+            case 'b': out += '\b'; break;
+            case 'f': out += '\f'; break;
+            case 'n': out += '\n'; break;
+            case 'r': out += '\r'; break;
+            case 't': out += '\t'; break;
+            case 'u': {
+                if (d->end - p < 4)
+                    return nofast(d);
+                int cp = hexvalue(p);
+                if (cp < 0)
+                    return nofast(d);
+                p += 4;
+                if (cp >= 0xd800 && cp < 0xdc00) {
+                    if (d->end - p < 6 || p[0] != '\\' || p[1] != 'u')
+                        return nofast(d);
+                    int low = hexvalue(p + 2);
+                    if (low < 0xdc00 || low >= 0xe000)
+                        return nofast(d);
+                    p += 6;
+                    cp = 0x10000 + ((cp - 0xd800) << 10) + (low - 0xdc00);
+                } else if (cp >= 0xdc00 && cp < 0xe000) {
+                    return nofast(d);
+                }
+                pututf8(out, cp);
+                break;
+            }
+            default:
+                return nofast(d);
+        }
+    }
+    if (p >= d->end)
+        return nofast(d);
+    d->p = p + 1;
+    return PyUnicode_DecodeUTF8(out.data(), out.size(), NULL);
+}
+
+static PyObject *
+decodenumber(Decoder *d)
+{
+    const char *start = d->p;
+    const char *p = start;
+    bool isfloat = 0;
+    if (p < d->end && *p == '-')
+        p++;
+    if (p >= d->end || *p < '0' || *p > '9')
+        return nofast(d);
+    if (*p == '0') {
+        p++;
+    } else {
+        while (p < d->end && *p >= '0' && *p <= '9') p++;
+    }
+    if (p < d->end && *p == '.') {
+        isfloat = 1;
+        p++;
+        if (p >= d->end || *p < '0' || *p > '9')
+            return nofast(d);
+        while (p < d->end && *p >= '0' && *p <= '9') p++;
+    }
+    if (p < d->end && (*p == 'e' || *p == 'E')) {
+        isfloat = 1;
+        p++;
+        if (p < d->end && (*p == '+' || *p == '-')) p++;
+        if (p >= d->end || *p < '0' || *p > '9')
+            return nofast(d);
+        while (p < d->end && *p >= '0' && *p <= '9') p++;
+    }
+    d->p = p;
+    if (isfloat) {
+        char tmp[64];
+        if (p - start >= (Py_ssize_t)sizeof(tmp))
+            return nofast(d);
+        memcpy(tmp, start, p - start);
+        tmp[p - start] = 0;
+        double v = PyOS_string_to_double(tmp, NULL, NULL);
+        if (v == -1.0 && PyErr_Occurred())
+            return NULL;
+        return PyFloat_FromDouble(v);
+    }
+    const char *digits = *start == '-' ? start + 1 : start;
+    if (p - digits > 18)
+        return nofast(d);
+    long long v = 0;
+    for (const char *q = digits; q < p; q++)
+        v = v * 10 + (*q - '0');
+    return PyLong_FromLongLong(*start == '-' ? -v : v);
+}
+
+static PyObject *
+decodeliteral(Decoder *d, const char *lit, Py_ssize_t len, PyObject *value)
+{
+    if (d->end - d->p < len || memcmp(d->p, lit, len) != 0)
+        return nofast(d);
+    d->p += len;
+    Py_INCREF(value);
+    return value;
+}
+
+static PyObject *
+decodekey(Decoder *d)
+{
+    PyObject *key = decodestring(d);
+    if (!key)
+        return NULL;
+    PyObject *memokey = PyDict_SetDefault(d->memo, key, key);
+    Py_XINCREF(memokey);
+    Py_DECREF(key);
+    return memokey;
+}
+
+static PyObject *
+decodeobject(Decoder *d)
+{
+    PyObject *ret = PyDict_New();
+    if (!ret)
+        return NULL;
+    skipws(d);
+    if (d->p < d->end && *d->p == '}') {
+        d->p++;
+        return ret;
+    }
+    while (1) {
+        if (d->p >= d->end || *d->p != '"')
+            goto fail;
+        d->p++;
+        PyObject *key = decodekey(d);
+        if (!key)
+            goto fail;
+        skipws(d);
+        if (d->p >= d->end || *d->p != ':') {
+            Py_DECREF(key);
+            d->nofast = 1;
+            goto fail;
+        }
+        d->p++;
+        skipws(d);
+        PyObject *value = decodevalue(d);
+        if (!value) {
+            Py_DECREF(key);
+            goto fail;
+        }
+        int err = PyDict_SetItem(ret, key, value);
+        Py_DECREF(key);
+        Py_DECREF(value);
+        if (err < 0)
+            goto fail;
+        skipws(d);
+        if (d->p < d->end && *d->p == ',') {
+            d->p++;
+            skipws(d);
+            continue;
+        }
+        if (d->p < d->end && *d->p == '}') {
+            d->p++;
+            return ret;
+        }
+        d->nofast = 1;
+        goto fail;
+    }
+fail:
+    if (!PyErr_Occurred())
+        d->nofast = 1;
+    Py_DECREF(ret);
+    return NULL;
+}
+
+static PyObject *
+decodearray(Decoder *d)
+{
+    PyObject *ret = PyList_New(0);
+    if (!ret)
+        return NULL;
+    skipws(d);
+    if (d->p < d->end && *d->p == ']') {
+        d->p++;
+        return ret;
+    }
+    while (1) {
+        PyObject *value = decodevalue(d);
+        if (!value)
+            goto fail;
+        int err = PyList_Append(ret, value);
+        Py_DECREF(value);
+        if (err < 0)
+            goto fail;
+        skipws(d);
+        if (d->p < d->end && *d->p == ',') {
+            d->p++;
+            skipws(d);
+            continue;
+        }
+        if (d->p < d->end && *d->p == ']') {
+            d->p++;
+            return ret;
+        }
+        d->nofast = 1;
+        goto fail;
+    }
+fail:
+    if (!PyErr_Occurred())
+        d->nofast = 1;
+    Py_DECREF(ret);
+    return NULL;
+}
+
+static PyObject *
+decodevalue(Decoder *d)
+{
+    if (d->p >= d->end)
+        return nofast(d);
+    PyObject *ret;
+    switch (*d->p) {
+        case '{':
+            if (++d->depth > MAX_DEPTH)
+                return nofast(d);
+            d->p++;
+            ret = decodeobject(d);
+            d->depth--;
+            return ret;
+        case '[':
+            if (++d->depth > MAX_DEPTH)
+                return nofast(d);
+            d->p++;
+            ret = decodearray(d);
+            d->depth--;
+            return ret;
+        case '"':
+            d->p++;
+            return decodestring(d);
+        case 't':
+            return decodeliteral(d, "true", 4, Py_True);
+        case 'f':
+            return decodeliteral(d, "false", 5, Py_False);
+        case 'n':
+            return decodeliteral(d, "null", 4, Py_None);
+        default:
+            return decodenumber(d);
+    }
+}
+
+/* Decode one item, falling back to loads when the fast path gives up */
+static PyObject *
+decodebuffer(const char *start, Py_ssize_t len, PyObject *memo, PyObject *loads)
+{
+    if (PyDict_Size(memo) > MEMO_MAX)
+        PyDict_Clear(memo);
+    Decoder d = {start, start + len, memo, 0, 0};
+    skipws(&d);
+    PyObject *result = decodevalue(&d);
+    if (result) {
+        skipws(&d);
+        if (d.p == d.end)
+            return result;
+        Py_DECREF(result);
+    } else if (!d.nofast) {
+        if (!PyErr_ExceptionMatches(PyExc_UnicodeDecodeError))
+            return NULL;
+        PyErr_Clear();
+    }
+    return PyObject_CallFunction(loads, "y#", start, len);
+}
+
+static PyObject *
+decodeitem(JSONLgenState *s, const char *start, Py_ssize_t len)
+{
+    return decodebuffer(start, len, s->memo, s->loads);
+}
+
+
+/* Build the result object for an item ending at buf[pos].
+ *
+ * Items that are fully inside the current chunk are copied exactly once, from
+ * the chunk to the resulting object. Items that started in an earlier chunk
+ * are assembled from the buffered head and the current chunk.
+ */
+static PyObject *
+makeitem(JSONLgenState *s, Py_ssize_t pos)
+{
+    PyObject *result;
+    const char *buf = s->buf;
+    if (s->parse && s->item >= 0) {
+        result = decodeitem(s, buf + s->item, pos - s->item + 1);
+    } else if (s->parse) {
+        s->data.insert(s->data.end(), buf, buf + pos + 1);
+        result = decodeitem(s, s->data.data(), s->data.size());
+    } else if (s->item >= 0) {
+        const char *start = buf + s->item;
+        Py_ssize_t len = pos - s->item + 1;
+        result = s->as_bytes ? PyBytes_FromStringAndSize(start, len)
+                             : PyUnicode_DecodeUTF8(start, len, NULL);
+    } else if (s->as_bytes) {
+        result = PyBytes_FromStringAndSize(NULL, s->data.size() + pos + 1);
+        if (result) {
+            char *dst = PyBytes_AS_STRING(result);
+            memcpy(dst, s->data.data(), s->data.size());
+            memcpy(dst + s->data.size(), buf, pos + 1);
+        }
+    } else {
+        s->data.insert(s->data.end(), buf, buf + pos + 1);
+        result = PyUnicode_DecodeUTF8(s->data.data(), s->data.size(), NULL);
+    }
+    s->data.clear();
+    if (s->data.capacity() > DATA_KEEP)
+        vector<char>().swap(s->data);
+    s->item = -1;
+    s->itemtype = 0;
+    s->off = pos + 1;
+    return result;
+}
+
+
+static void
+startitem(JSONLgenState *s, Py_ssize_t pos, char c)
+{
+    s->item = pos;
+    s->itemtype = c;
+}
+
+
+/* Scan the current chunk from where the previous call stopped.
+ *
+ * Returns the next item, or NULL when the chunk is exhausted (with an
+ * exception set on error). Each call only touches the bytes of the item it
+ * returns, so splitting a chunk costs O(chunk length) in total.
+ */
+static PyObject *
+parsejsonl(JSONLgenState *s){
+    const char *buf = s->buf;
+    for(Py_ssize_t pos = s->off; pos < s->len; pos++){
+        char c = buf[pos];
+        if(DEBUG) cerr << c << " " << s->quote << s->escape << (int) s->obj << (int) s->list << " " << pos << " " << s->data.size() << endl;
         if (s->escape > 0){
             s->escape = 0;
         }
@@ -42,126 +500,183 @@ void parsejsonl(string &str, JSONLgenState *s){
             s->escape = 1;
         }
         else if(c == '"'){
+            s->quote = 1 - s->quote;
             if(s->list < 2){
-                if(s->item < 0){
-                    s->item = s->pos;
+                if(s->itemtype == 0){
+                    startitem(s, pos, c);
                 } else if (s->obj == 0){
                     if(DEBUG) cerr << "yielding 1" << endl;
-                    s->items.push(string(s->data.begin() + s->item, s->data.begin() + s->pos + 1));
-                    s->data.erase(s->data.begin(), s->data.begin() + s->pos + 1);
-                    s->pos = -1;
-                    s->item = -1;
+                    return makeitem(s, pos);
                 }
             }
-            s->quote = 1 - s->quote;
         }
         else if (s->quote > 0) ;
         else if (c == '}'){
             s->obj--;
-            if (s->obj == 0 && (! (s->item < 0) && s->data[s->item] == '{')){
+            if (s->obj == 0 && s->itemtype == '{'){
                 if(DEBUG) cerr << "yielding 2" << endl;
-                s->items.push(string(s->data.begin() + s->item, s->data.begin() + s->pos + 1));
-                s->data.erase(s->data.begin(), s->data.begin() + s->pos + 1);
-                s->pos = -1;
-                s->item = -1;
+                return makeitem(s, pos);
             }
         }
         else if (c == '{'){
             s->obj++;
-            if(s->item < 0) { s->item = s->pos; }
+            if(s->itemtype == 0) { startitem(s, pos, c); }
         }
         else if (c == '['){
             s->list++;
-            if(s->list > 1 && s->item < 0) { s->item = s->pos; }
+            if(s->list > 1 && s->itemtype == 0) { startitem(s, pos, c); }
         }
         else if (c == ']') {
             s->list--;
-            if (s->list == 1 && (! (s->item < 0) && s->data[s->item] == '[')){
+            if (s->list == 1 && s->itemtype == '['){
                 if(DEBUG) cerr << "yielding 3" << endl;
-                s->items.push(string(s->data.begin() + s->item, s->data.begin() + s->pos + 1));
-                s->data.erase(s->data.begin(), s->data.begin() + s->pos + 1);
-                s->pos = -1;
-                s->item = -1;
+                return makeitem(s, pos);
             }
         }
     }
+    /* Keep the unfinished item for the next chunk */
+    if (s->itemtype != 0) {
+        Py_ssize_t start = s->item >= 0 ? s->item : s->off;
+        s->data.insert(s->data.end(), buf + start, buf + s->len);
+        s->item = -1;
+    }
+    releasechunk(s);
+    return NULL;
+}
+
+
+/* Take the next element of the input iterator into use.
+ *
+ * str chunks are read through their cached UTF-8 representation and all
+ * objects supporting the buffer protocol (bytes, bytearray, memoryview, mmap)
+ * are scanned in place without copying. The chunk is held until it has been
+ * scanned through.
+ */
+static int
+setchunk(JSONLgenState *jfstate, PyObject *elem)
+{
+    if (PyUnicode_Check(elem)) {
+        Py_ssize_t len;
+        const char *buf = PyUnicode_AsUTF8AndSize(elem, &len);
+        if (!buf)
+            return -1;
+        jfstate->buf = buf;
+        jfstate->len = len;
+    } else {
+        if (PyObject_GetBuffer(elem, &jfstate->view, PyBUF_SIMPLE) < 0) {
+            PyErr_Format(PyExc_TypeError,
+                         "jsonlgen.gen() expects str or bytes-like items, not %.200s",
+                         Py_TYPE(elem)->tp_name);
+            return -1;
+        }
+        jfstate->buf = (const char *)jfstate->view.buf;
+        jfstate->len = jfstate->view.len;
+    }
+    Py_INCREF(elem);
+    jfstate->chunk = elem;
+    jfstate->off = 0;
+    return 0;
 }
 
 
 static PyObject *
 jsonlgen_next(JSONLgenState *jfstate)
 {
-    /* seq_length < 0 means that the generator is exhausted.
-     * Returning NULL in this case is enough. The next() builtin will raise the
-     * StopIteration error for us->
+    /* Returning NULL without an exception set means that the generator is
+     * exhausted. The next() builtin will raise the StopIteration error for us.
     */
-    if ( !jfstate->items.empty() ) {
-        string item = jfstate->items.front();
-        if(DEBUG) cerr << "Items has " << jfstate->items.size() << " items. Yielding " << item << endl;
-        PyObject *result = Py_BuildValue("s", item.c_str());
-        jfstate->items.pop();
-        return result;
-    }
-    PyObject *iterator = PyObject_GetIter(jfstate->iter);
-
-    PyObject *elem;
-    while((elem = PyIter_Next(iterator))) {
-        /* Exceptions from PySequence_GetItem are propagated to the caller
-         * (elem will be NULL so we also return NULL).
-        */
-        if (elem) {
-            string str(PyUnicode_AsUTF8(elem));
-            parsejsonl(str, jfstate);
-            if ( !jfstate->items.empty() ) {
-                string item = jfstate->items.front();
-                if(DEBUG) cerr << "Items has " << jfstate->items.size() << " items. Yielding " << item << endl;
-                PyObject *result = Py_BuildValue("s", item.c_str());
-                jfstate->items.pop();
+    while (1) {
+        if (jfstate->chunk) {
+            PyObject *result = parsejsonl(jfstate);
+            if (result || PyErr_Occurred())
                 return result;
-            }
         }
+        PyObject *elem = PyIter_Next(jfstate->iter);
+        if (!elem)
+            return NULL;
+        int ret = setchunk(jfstate, elem);
         Py_DECREF(elem);
+        if (ret < 0)
+            return NULL;
     }
-
-    /* The reference to the sequence is cleared in the first generator call
-     * after its exhaustion (after the call that returned the last element).
-     * Py_CLEAR will be harmless for subsequent calls since it's idempotent
-     * on NULL.
-    */
-    Py_DECREF(iterator);
-    return NULL;
 }
 
 static PyObject *
 jsonlgen_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
 {
-    PyObject *iter;
+    static const char *kwlist[] = {"iterable", "as_bytes", "parse", "loads", NULL};
+    PyObject *iterable;
+    PyObject *loads = NULL;
+    int as_bytes = 0;
+    int parse = 0;
 
-    if (!PyArg_UnpackTuple(args, "gen", 1, 1, &iter))
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|ppO:gen", (char **)kwlist,
+                                     &iterable, &as_bytes, &parse, &loads))
         return NULL;
 
-    /* We expect an argument that supports the sequence protocol */
-    if (!PyIter_Check(iter)) {
-        PyErr_SetString(PyExc_TypeError, "jsonlgen.gen() expects a iterable");
+    if (loads == Py_None)
+        loads = NULL;
+    if (loads) {
+        Py_INCREF(loads);
+    } else if (parse) {
+        PyObject *json = PyImport_ImportModule("json");
+        if (!json)
+            return NULL;
+        loads = PyObject_GetAttrString(json, "loads");
+        Py_DECREF(json);
+        if (!loads)
+            return NULL;
+    }
+
+    PyObject *memo = PyDict_New();
+    PyObject *iter = memo ? PyObject_GetIter(iterable) : NULL;
+    if (!iter) {
+        if (memo)
+            PyErr_SetString(PyExc_TypeError, "jsonlgen.gen() expects a iterable");
+        Py_XDECREF(memo);
+        Py_XDECREF(loads);
         return NULL;
     }
 
-    /* Create a new JSONLgenState and initialize its state - pointing to the last
-     * index in the sequence.
-    */
+    /* Create a new JSONLgenState and initialize its state */
     JSONLgenState *jfstate = (JSONLgenState *)type->tp_alloc(type, 0);
-    if (!jfstate)
+    if (!jfstate) {
+        Py_DECREF(iter);
+        Py_DECREF(memo);
+        Py_XDECREF(loads);
         return NULL;
+    }
 
-    Py_INCREF(iter);
     jfstate->iter = iter;
-    jfstate->item = -1 ;
-    jfstate->pos = -1 ;
-    jfstate->items = queue<string>();
+    jfstate->chunk = NULL;
+    jfstate->view.obj = NULL;
+    jfstate->buf = NULL;
+    jfstate->len = 0;
+    jfstate->off = 0;
+    new (&jfstate->data) vector<char>();
+    jfstate->as_bytes = as_bytes;
+    jfstate->parse = parse;
+    jfstate->loads = loads;
+    jfstate->memo = memo;
+    jfstate->quote = 0;
+    jfstate->escape = 0;
+    jfstate->obj = 0;
+    jfstate->list = 0;
+    jfstate->itemtype = 0;
+    jfstate->item = -1;
 
     return (PyObject *)jfstate;
 }
 
+PyDoc_STRVAR(jsonlgen_doc,
+"gen(iterable, as_bytes=False, parse=False, loads=json.loads)\n\n"
+"Split json and json lines read from iterable into items.\n\n"
+"The iterable may yield str or any bytes-like object (bytes, bytearray,\n"
+"memoryview, mmap). Items are yielded as str, or as bytes if as_bytes is set.\n"
+"With parse set, items are decoded straight into python objects. Items the\n"
+"built-in decoder does not handle (NaN, huge integers, ...) are passed to\n"
+"loads as bytes.");
+
 PyTypeObject PyJSONLgen_Type = {
     PyVarObject_HEAD_INIT(&PyType_Type, 0)
     "gen",                       /* tp_name */
@@ -183,7 +698,7 @@ PyTypeObject PyJSONLgen_Type = {
     0,                              /* tp_setattro */
     0,                              /* tp_as_buffer */
     Py_TPFLAGS_DEFAULT,             /* tp_flags */
-    0,                              /* tp_doc */
+    jsonlgen_doc,                   /* tp_doc */
     0,                              /* tp_traverse */
     0,                              /* tp_clear */
     0,                              /* tp_richcompare */
@@ -205,11 +720,185 @@ PyTypeObject PyJSONLgen_Type = {
 
 
 
+/* Scanning of json text without building python objects
+ *
+ * Used to locate single fields of an object, so that only the fields a query
+ * reads have to be decoded.
+ */
+static inline const char *
+skipws(const char *p, const char *end)
+{
+    while (p < end && (*p == ' ' || *p == '\t' || *p == '\n' || *p == '\r'))
+        p++;
+    return p;
+}
+
+/* p is at the opening quote, returns the position after the closing quote.
+ * If escaped is given, it is set when the string contains escapes.
+ */
+static const char *
+skipstring(const char *p, const char *end, bool *escaped)
+{
+    const char *q = p + 1;
+    while (q < end) {
+        const char *quote = (const char *)memchr(q, '"', end - q);
+        if (!quote)
+            return NULL;
+        const char *b = quote;
+        while (b > q && b[-1] == '\\')
+            b--;
+        if ((quote - b) % 2 == 0) {
+            if (escaped && memchr(p + 1, '\\', quote - p - 1))
+                *escaped = 1;
+            return quote + 1;
+        }
+        q = quote + 1;
+    }
+    return NULL;
+}
+
+static const char *
+skipvalue(const char *p, const char *end)
+{
+    if (p >= end)
+        return NULL;
+    if (*p == '"')
+        return skipstring(p, end, NULL);
+    if (*p == '{' || *p == '[') {
+        int depth = 0;
+        while (p < end) {
+            switch (*p) {
+            case '"':
+                p = skipstring(p, end, NULL);
+                if (!p)
+                    return NULL;
+                continue;
+            case '{':
+            case '[':
+                depth++;
+                break;
+            case '}':
+            case ']':
+                if (--depth == 0)
+                    return p + 1;
+                break;
+            }
+            p++;
+        }
+        return NULL;
+    }
+    const char *start = p;
+    while (p < end && *p != ',' && *p != '}' && *p != ']' && *p != ' '
+           && *p != '\t' && *p != '\n' && *p != '\r')
+        p++;
+    return p == start ? NULL : p;
+}
+
+static PyObject *
+jsonlgen_find(PyObject *module, PyObject *args)
+{
+    Py_buffer view;
+    const char *key;
+    Py_ssize_t keylen;
+    if (!PyArg_ParseTuple(args, "y*s#", &view, &key, &keylen))
+        return NULL;
+
+    const char *start = (const char *)view.buf;
+    const char *end = start + view.len;
+    const char *p = skipws(start, end);
+    const char *found = NULL, *foundend = NULL;
+    bool unknown = 0;
+
+    if (p >= end || *p++ != '{')
+        goto invalid;
+    p = skipws(p, end);
+    if (p < end && *p == '}')
+        goto done;
+    while (1) {
+        bool escaped = 0;
+        if (p >= end || *p != '"')
+            goto invalid;
+        const char *k = p + 1;
+        p = skipstring(p, end, &escaped);
+        if (!p)
+            goto invalid;
+        Py_ssize_t klen = p - 1 - k;
+        p = skipws(p, end);
+        if (p >= end || *p++ != ':')
+            goto invalid;
+        p = skipws(p, end);
+        const char *value = p;
+        p = skipvalue(p, end);
+        if (!p)
+            goto invalid;
+        if (escaped) {
+            unknown = 1;
+        } else if (klen == keylen && memcmp(k, key, keylen) == 0) {
+            /* Like json.loads, the last of duplicate keys wins */
+            found = value;
+            foundend = p;
+        }
+        p = skipws(p, end);
+        if (p < end && *p == ',') {
+            p = skipws(p + 1, end);
+            continue;
+        }
+        if (p < end && *p == '}')
+            break;
+        goto invalid;
+    }
+
+done:
+    PyBuffer_Release(&view);
+    if (unknown)
+        Py_RETURN_FALSE;
+    if (found)
+        return Py_BuildValue("nn", found - start, foundend - start);
+    Py_RETURN_NONE;
+
+invalid:
+    PyBuffer_Release(&view);
+    PyErr_SetString(PyExc_ValueError, "invalid json object");
+    return NULL;
+}
+
+PyDoc_STRVAR(jsonlgen_find_doc,
+"find(buffer, key)\n\n"
+"Locate the value of a top-level key in a json object without decoding it.\n\n"
+"Returns the (start, end) offsets of the value in buffer, None if the key is\n"
+"not there, or False if the object has escaped keys that would need decoding.");
+
+static PyObject *loadsmemo = NULL;
+
+static PyObject *
+jsonlgen_loads(PyObject *module, PyObject *args)
+{
+    Py_buffer view;
+    PyObject *loads;
+    if (!PyArg_ParseTuple(args, "y*O", &view, &loads))
+        return NULL;
+    PyObject *result = decodebuffer((const char *)view.buf, view.len, loadsmemo, loads);
+    PyBuffer_Release(&view);
+    return result;
+}
+
+PyDoc_STRVAR(jsonlgen_loads_doc,
+"loads(buffer, loads)\n\n"
+"Decode a json value with the built-in decoder of gen(parse=True).\n\n"
+"Values the built-in decoder does not handle are passed to loads as bytes.");
+
+static PyMethodDef jsonlgen_methods[] = {
+    {"find", jsonlgen_find, METH_VARARGS, jsonlgen_find_doc},
+    {"loads", jsonlgen_loads, METH_VARARGS, jsonlgen_loads_doc},
+    {NULL, NULL, 0, NULL}
+};
+
 static struct PyModuleDef jsonlmodule = {
   PyModuleDef_HEAD_INIT,
   "jsonlgen",                  /* m_name */
   "",                      /* m_doc */
   -1,                      /* m_size */
+  jsonlgen_methods,        /* m_methods */
 };
 
 PyMODINIT_FUNC
@@ -221,6 +910,9 @@ PyInit_jsonlgen(void)
 
     if (PyType_Ready(&PyJSONLgen_Type) < 0)
         return NULL;
+    loadsmemo = PyDict_New();
+    if (!loadsmemo)
+        return NULL;
     Py_INCREF((PyObject *)&PyJSONLgen_Type);
     PyModule_AddObject(module, "gen", (PyObject *)&PyJSONLgen_Type);
 
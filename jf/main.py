@@ -1,6 +1,8 @@
-from .query_parser import parse_query
-from .process import run_query, dotaccessible
-from .jfio import data_input, print_results
+from .query_parser import parse_query, query_pushdown
+from .process import run_query, dotaccessible, import_modules
+from .process import ShardedFile, SeekableFile, RawRecords
+from .jfio import data_input, print_results, dump_json, is_jsonl_file
+from .jfio import read_index, build_index, jsonl_index
 
 
 def jf(
@@ -16,6 +18,10 @@ def jf(
     debug,
     raw,
     init,
+    prefetch=2,
+    interleave=False,
+    index=False,
+    unordered=False,
 ):
     """Main of the machine
 
@@ -86,30 +92,90 @@ def jf(
     additionals = {k: v[0] if len(v) == 1 else v for k, v in additionals.items()}
     additionals["env"] = dotaccessible({k: v for k, v in os.environ.items()})
     if imports:
-        import importlib
-        import sys
-        import os
-
-        sys.path.append(os.path.dirname("."))
-        for path in import_path:
-            sys.path.append(path)
-        additionals.update(
-            dict(
-                [[name(imp), importlib.import_module(filepath(imp))] for imp in imports]
-            )
-        )
+        additionals.update(import_modules(imports, import_path))
     additionals["JF_init_codes"] = [parse_query(i, dosplit=False) for i in init]
 
     # input data
-    data = data_input(files, additionals, inputfmt)
+    if index:
+        for fn in files:
+            if is_jsonl_file(fn, threshold=1) and read_index(fn) is None:
+                build_index(fn)
+    # Queries that read a known set of fields decode only those
+    columns, filters = query_pushdown(queries)
+    if can_shard(processes, files, inputfmt, output, raw):
+        from functools import partial
+
+        data = ShardedFile(
+            files[0], partial(dump_json, compact=compact), lazy=columns is not None
+        )
+    else:
+        parallel = processes > 1 and not listen
+        data = data_input(
+            files,
+            additionals,
+            inputfmt,
+            prefetch=prefetch,
+            interleave=interleave,
+            columns=columns,
+            filters=filters,
+            lazy=columns is not None and not parallel,
+            raw=parallel,
+        )
+        if parallel:
+            # Workers parse the records, and serialize them for json output
+            serializer = None
+            if output in ("json", "jsonl") and not raw:
+                from functools import partial
+
+                serializer = partial(dump_json, compact=compact)
+            data = RawRecords(data, serializer, lazy=columns is not None)
+        elif is_seekable(files, inputfmt):
+            data = SeekableFile(files[0], data, lazy=columns is not None)
 
     # processing
-    ret = run_query(query, data, additionals, from_file, processes, listen)
+    ret = run_query(
+        query, data, additionals, from_file, processes, listen, unordered
+    )
 
     # output
     print_results(ret, output, compact, raw, additionals)
 
 
+def can_shard(processes, files, inputfmt, output, raw):
+    """
+    Can worker processes parse and serialize their own parts of the input
+
+    This is the case for a single large json lines file written out as json.
+    The file is split at newlines, so it needs an index that shows every
+    line is a record.
+    """
+    return (
+        processes > 1
+        and len(files) == 1
+        and "://" not in files[0]
+        and inputfmt in (None, "json", "jsonl")
+        and output in ("json", "jsonl")
+        and not raw
+        and is_jsonl_file(files[0])
+        and jsonl_index(files[0]) is not None
+    )
+
+
+def is_seekable(files, inputfmt):
+    """
+    Can query stages read the records of the input from any position
+
+    This is the case for a single uncompressed json lines file. SeekableFile
+    checks that every line is a record before it seeks.
+    """
+    return (
+        len(files) == 1
+        and "://" not in files[0]
+        and inputfmt in (None, "json", "jsonl")
+        and is_jsonl_file(files[0], threshold=1)
+    )
+
+
 def filepath(x):
     return x.split("=")[-1]
 
@@ -2,6 +2,21 @@ from abc import ABC, abstractmethod
 
 
 class JFTransformation(ABC):
+    """
+    Query function over the whole stream of items
+
+    Transformations that can be computed in parts also define
+    partial(arr), which returns a picklable partial result for some of
+    the items, and combine(partials), which yields the output from the
+    partial results of consecutive parts in order. With --processes the
+    partial results are then computed in the worker processes.
+
+    Transformations whose output depends on the order of the items set
+    ordered = True. They keep --unordered pipelines in input order.
+    """
+
+    ordered = False
+
     def __init__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
@@ -12,3 +27,104 @@ class JFTransformation(ABC):
 
     def __call__(self, arr):
         return self._fn(arr)
+
+
+HANDLER_KINDS = ("fetch", "serialize", "unserialize")
+REGISTRY = {kind: {} for kind in ("function",) + HANDLER_KINDS}
+_registered_modules = {}
+
+
+def camel_to_snake(name):
+    import re
+
+    name = re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+    return name
+
+
+class LazyEntry:
+    """Registry entry imported from "module:attr" when first used"""
+
+    __slots__ = ("path", "_target")
+
+    def __init__(self, path):
+        self.path = path
+        self._target = None
+
+    def resolve(self):
+        if self._target is None:
+            import importlib
+
+            module, _, attr = self.path.partition(":")
+            self._target = getattr(importlib.import_module(module), attr)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyEntry({self.path!r})"
+
+
+def register(kind, *names, lazy=None):
+    """
+    Register a query function or an IO handler under names
+
+    Used as a decorator, the name defaults to the snake_case name of the
+    decorated object. With lazy="module:attr" nothing is imported until the
+    entry is first used. The registry is shared by the whole process, so
+    entries stay registered for the queries that follow.
+
+    >>> @register("serialize", "shout")
+    ... def shout(data):
+    ...     return str(data).upper().encode()
+    >>> lookup("serialize", "shout")(["a"]), lookup("serialize", "whisper")
+    (b"['A']", None)
+    >>> register("function", "b64", lazy="base64:b64encode")
+    LazyEntry('base64:b64encode')
+    >>> lookup("function", "b64")(b"jf")
+    b'amY='
+    >>> del REGISTRY["serialize"]["shout"], REGISTRY["function"]["b64"]
+    """
+    table = REGISTRY[kind]
+    if lazy is not None:
+        entry = LazyEntry(lazy)
+        for name in names:
+            table[name] = entry
+        return entry
+
+    def _register(obj):
+        for name in names or [camel_to_snake(obj.__name__)]:
+            table[name] = obj
+        return obj
+
+    return _register
+
+
+def lookup(kind, name):
+    """Registered entry for name, imported if it was registered lazily"""
+    entry = REGISTRY[kind].get(name)
+    if type(entry) is LazyEntry:
+        entry = REGISTRY[kind][name] = entry.resolve()
+    return entry
+
+
+def register_module(module):
+    """
+    Register the jf_fetch_*, jf_serialize_* and jf_unserialize_* handlers
+    of a module. Each module is only scanned once.
+
+    >>> class mod:
+    ...     def jf_unserialize_txt(f):
+    ...         return f.read().split()
+    >>> register_module(mod)
+    >>> lookup("unserialize", "txt") is mod.jf_unserialize_txt
+    True
+    >>> del REGISTRY["unserialize"]["txt"]
+    """
+    if id(module) in _registered_modules:
+        return
+    _registered_modules[id(module)] = module
+    for attr in dir(module):
+        kind, _, name = attr[3:].partition("_")
+        if attr[:3] == "jf_" and kind in HANDLER_KINDS and name:
+            REGISTRY[kind][name] = getattr(module, attr)
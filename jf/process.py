@@ -1,17 +1,54 @@
 _funcs = None
+_jsonlgen = None
+_lazy_records = False
+_aggregate = None
 
 
 class DotAccessibleNone:
-    __dict__ = None
+    """
+    Missing value that stays dot accessible. There is only one instance.
+
+    >>> DotAccessibleNone() is DotAccessibleNone().a.b, bool(DotAccessibleNone())
+    (True, False)
+    """
+
+    __slots__ = ()
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
 
     def __getattr__(self, k):
-        return DotAccessibleNone()
+        if k.startswith("__"):
+            raise AttributeError(k)
+        return self
+
+    def __bool__(self):
+        return False
+
+    def __eq__(self, other):
+        return other is None or other is self
+
+    def __hash__(self):
+        return hash(None)
+
+    def __repr__(self):
+        return "None"
+
+    def __reduce__(self):
+        return DotAccessibleNone, ()
 
 
 class DotAccessible(dict):
     """
     Dot accessible version of a dict. For syntactic sugar.
 
+    Fields are only stored in the dict itself. Attributes are looked up with
+    __getattr__, so records have no instance __dict__. Nested dicts are
+    wrapped when they are first read and the wrapper replaces them.
+
     >>> it = DotAccessible({"a": 5})
     >>> it.a
     5
@@ -25,40 +62,246 @@ class DotAccessible(dict):
     {'a': 5}
     >>> DotAccessible({"a": 5}, b=1)
     {'a': 5, 'b': 1}
+    >>> it = DotAccessible({"a": None, "b": {"c": 1}})
+    >>> type(dict.get(it, "b")).__name__, it.b.c, type(dict.get(it, "b")).__name__
+    ('dict', 1, 'DotAccessible')
+    >>> it.b.d = 2
+    >>> it, it["b"] is it.b
+    ({'a': None, 'b': {'c': 1, 'd': 2}}, True)
+
+    Fields named like dict methods are read as fields, the methods are
+    used for records without such a field.
+
+    >>> it = DotAccessible({"items": 1, "keys": {"a": 2}})
+    >>> it.items, it.keys.a, list(DotAccessible({"a": 1}).keys())
+    (1, 2, ['a'])
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(it))
+    {'items': 1, 'keys': {'a': 2}}
     """
 
-    def __init__(self, *args, **kwargs):
-        super(DotAccessible, self).__init__(*args, **kwargs)
-        for arg in args:
-            if isinstance(arg, dict):
-                for k, v in arg.items():
-                    self[k] = dotaccessible(v)
-
-        if kwargs:
-            for k, v in kwargs.items():
-                self[k] = dotaccessible(v)
+    __slots__ = ()
 
     def __getattr__(self, k):
-        return dotaccessible(
-            self.get(k) if not k.startswith("__") else super().__getattr__(k)
-        )
+        if k.startswith("__"):
+            raise AttributeError(k)
+        value = _nested(self, k, dict.get(self, k))
+        return DotAccessibleNone() if value is None else value
 
-    def __setattr__(self, key, value):
-        self.__setitem__(key, value)
+    def __getitem__(self, k):
+        return _nested(self, k, dict.__getitem__(self, k))
 
-    def __setitem__(self, key, value):
-        super(DotAccessible, self).__setitem__(key, value)
-        self.__dict__.update({key: value})
+    def get(self, k, default=None):
+        if dict.__contains__(self, k):
+            return _nested(self, k, dict.__getitem__(self, k))
+        return default
+
+    def __setattr__(self, key, value):
+        self[key] = value
 
     def __delattr__(self, item):
-        self.__delitem__(item)
+        del self[item]
+
+    def __reduce__(self):
+        # The default reduce reads .items(), which may be a field
+        return DotAccessible, (dict(dict.items(self)),)
+
+
+def _nested(record, k, value):
+    """value of field k, with a plain dict wrapped and stored back once"""
+    if type(value) is dict:
+        value = DotAccessible(value)
+        dict.__setitem__(record, k, value)
+    return value
 
-    def __delitem__(self, key):
-        super(DotAccessible, self).__delitem__(key)
-        del self.__dict__[key]
+
+def _json_loads(raw):
+    import json
+
+    return json.loads(raw)
+
+
+def _materializing(name):
+    method = getattr(DotAccessible, name)
+
+    def _method(self, *args, **kwargs):
+        if self._jf_raw is not None:
+            self.materialize()
+        return method(self, *args, **kwargs)
+
+    _method.__name__ = name
+    return _method
+
+
+class LazyRecord(DotAccessible):
+    """
+    Json object that decodes its fields on first access
+
+    Only the raw json is kept. Reading a field locates and decodes just that
+    field and nested objects are lazy as well, so x.a.b decodes only b. The
+    whole record is decoded when it is iterated, compared, serialized or
+    when fields are removed. Fields that are set are kept until then.
+
+    >>> it = LazyRecord(b'{"a": {"b": 1, "c": [2]}, "d": "x"}')
+    >>> it.a.b, it["d"], "e" in it, isinstance(it.e, DotAccessibleNone)
+    (1, 'x', False, True)
+    >>> dict.__len__(it), dict.__len__(it.a)
+    (2, 1)
+    >>> it.f = 1
+    >>> it
+    {'a': {'b': 1, 'c': [2]}, 'd': 'x', 'f': 1}
+    >>> LazyRecord(b'{"items": [1], "values": 2}').items
+    [1]
+    >>> it = LazyRecord(b'{"a": 1, "b": [}')
+    >>> isinstance(it.b, DotAccessibleNone), it
+    (True, {})
+    """
+
+    __slots__ = ("_jf_raw",)
+
+    def __init__(self, raw):
+        global _lazy_records
+        _lazy_records = True
+        super().__init__()
+        object.__setattr__(self, "_jf_raw", raw)
+
+    def _field(self, k):
+        """Decoded and cached field k, or JFMISSING"""
+        global _jsonlgen
+        value = dict.get(self, k, JFMISSING)
+        if value is not JFMISSING or self._jf_raw is None:
+            return value
+        if _jsonlgen is None:
+            from . import jsonlgen as _jsonlgen
+
+        try:
+            span = _jsonlgen.find(self._jf_raw, k)
+        except ValueError:
+            # Invalid json has no fields, like the item the eager reader
+            # makes of it
+            self.materialize()
+            return dict.get(self, k, JFMISSING)
+        if span is None:
+            return JFMISSING
+        if span is False:
+            self.materialize()
+            return dict.get(self, k, JFMISSING)
+        raw = self._jf_raw[span[0] : span[1]]
+        if raw[:1] == b"{":
+            value = LazyRecord(raw)
+        else:
+            value = _jsonlgen.loads(raw, _json_loads)
+        DotAccessible.__setitem__(self, k, value)
+        return value
+
+    def materialize(self):
+        """Decode all fields, keeping the ones already decoded"""
+        import json
+
+        raw = self._jf_raw
+        object.__setattr__(self, "_jf_raw", None)
+        done = dict(dict.items(self))
+        dict.clear(self)
+        try:
+            decoded = json.loads(raw)
+        except ValueError:
+            decoded = {}
+        for k, v in decoded.items():
+            value = done.pop(k, JFMISSING)
+            DotAccessible.__setitem__(self, k, v if value is JFMISSING else value)
+        # Fields set before decoding come after the decoded ones, like an update
+        for k, v in done.items():
+            DotAccessible.__setitem__(self, k, v)
+        return self
+
+    def __getattr__(self, k):
+        if k.startswith("__"):
+            raise AttributeError(k)
+        value = self._field(k)
+        if value is JFMISSING or value is None:
+            return DotAccessibleNone()
+        return _nested(self, k, value)
+
+    def __getitem__(self, k):
+        value = self._field(k)
+        if value is JFMISSING:
+            raise KeyError(k)
+        return _nested(self, k, value)
+
+    def get(self, k, default=None):
+        value = self._field(k)
+        return default if value is JFMISSING else _nested(self, k, value)
+
+    def __contains__(self, k):
+        return self._field(k) is not JFMISSING
+
+    def __setitem__(self, k, v):
+        DotAccessible.__setitem__(self, k, v)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def __bool__(self):
+        if self._jf_raw is not None:
+            return self._jf_raw.strip()[1:-1].strip() != b""
+        return dict.__len__(self) > 0
+
+    def __reduce__(self):
+        if self._jf_raw is not None:
+            return LazyRecord, (self._jf_raw,)
+        return DotAccessible, (dict(dict.items(self)),)
+
+
+
+# dict methods that see every field
+for _name in (
+    "__iter__",
+    "__len__",
+    "__eq__",
+    "__ne__",
+    "__repr__",
+    "__reversed__",
+    "__or__",
+    "__ror__",
+    "__ior__",
+    "__delitem__",
+    "keys",
+    "items",
+    "values",
+    "copy",
+    "pop",
+    "popitem",
+    "setdefault",
+    "clear",
+):
+    setattr(LazyRecord, _name, _materializing(_name))
+
+
+class _FieldOrMethod:
+    """Field of a record named like a dict method, or else the method"""
+
+    __slots__ = ("name", "method")
+
+    def __init__(self, name, method):
+        self.name = name
+        self.method = method
+
+    def __get__(self, obj, cls=None):
+        if obj is not None and obj.__contains__(self.name):
+            return obj.__getattr__(self.name)
+        return self.method.__get__(obj, cls)
+
+
+for _cls in (DotAccessible, LazyRecord):
+    for _name in dir(dict):
+        if not _name.startswith("_") and _name != "fromkeys":
+            setattr(_cls, _name, _FieldOrMethod(_name, getattr(_cls, _name)))
 
 
 def undotaccessible(it):
+    if isinstance(it, LazyRecord) and it._jf_raw is not None:
+        it.materialize()
     if isinstance(it, dict):
         return {k: undotaccessible(v) for k, v in dict.items(it)}
     if isinstance(it, list):
@@ -68,26 +311,319 @@ def undotaccessible(it):
     return it
 
 
+def materialize_lazy(it):
+    """
+    Decode the LazyRecords in it in place and return it
+
+    json's C encoder reads the size of a dict directly and would write a
+    LazyRecord that is not decoded yet as {}. Nothing is walked until the
+    first LazyRecord has been created.
+
+    >>> it = {"a": [LazyRecord(b'{"b": 1}')]}
+    >>> materialize_lazy(it) is it, dict.__len__(it["a"][0])
+    (True, 1)
+    """
+    if not _lazy_records:
+        return it
+    if type(it) is LazyRecord and it._jf_raw is not None:
+        it.materialize()
+    if isinstance(it, dict):
+        for v in dict.values(it):
+            if isinstance(v, (dict, list)):
+                materialize_lazy(v)
+    elif isinstance(it, list):
+        for v in it:
+            if isinstance(v, (dict, list)):
+                materialize_lazy(v)
+    return it
+
+
 def dotaccessible(it):
+    """
+    Wrap dicts and None for dot access. Wrapped values are returned as is.
+
+    >>> it = dotaccessible({"a": {"b": 1}})
+    >>> dotaccessible(it) is it, dotaccessible(None).a, dotaccessible([1])
+    (True, None, [1])
+    """
     if it is None:
         return DotAccessibleNone()
-    if isinstance(it, dict):
+    if isinstance(it, dict) and not isinstance(it, DotAccessible):
         return DotAccessible(it)
     return it
 
 
-def worker_init(funcs):
+def worker_init(funcs, aggregate=None):
     """
     initializer for the worker in multiprocessing
+
+    With aggregate, a transformation with partial and combine methods, the
+    workers return its partial result for each batch.
     """
-    global _funcs
+    global _funcs, _aggregate
     _funcs = funcs
+    _aggregate = aggregate
 
 
 class JFREMOVED:
     pass
 
 
+class JFMISSING:
+    pass
+
+
+class SerializedLines(bytes):
+    """Output lines that a worker process has already serialized"""
+
+
+class ShardedFile:
+    """
+    Json lines file that worker processes read in byte ranges
+
+    Iterating the file reads all of it in the current process. mymap hands
+    the byte ranges to the workers instead when the whole pipeline can be
+    run per record, or per record and then by an aggregate.
+    """
+
+    def __init__(self, fn, serializer, lazy=False, shard_size=64 << 20):
+        self.fn = fn
+        self.serializer = serializer
+        self.lazy = lazy
+        self.shard_size = shard_size
+
+    def __iter__(self):
+        from .jfio import yield_mmap_json, try_json_loads
+
+        return yield_mmap_json(self.fn, loads=try_json_loads, lazy=self.lazy)
+
+    def tasks(self, processes):
+        """Ranges small enough to keep every process busy and bounded in memory"""
+        import os
+
+        size = os.path.getsize(self.fn)
+        shard_size = min(self.shard_size, max(size // (4 * processes), 1))
+        from .jfio import newline_ranges
+
+        return [
+            (self.fn, start, end, self.serializer, self.lazy)
+            for start, end in newline_ranges(self.fn, shard_size)
+        ]
+
+
+class SeekableFile:
+    """
+    Uncompressed json lines file whose records can be read from any position
+
+    Iterating yields the records of the given reader. A first query stage
+    with a seek method (islice, last) reads only the records it yields, once
+    the index of the file shows that every line is a record. Files that are
+    not line delimited are read through the given reader.
+    """
+
+    def __init__(self, fn, records, lazy=False):
+        self.fn = fn
+        self.records = records
+        self.lazy = lazy
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def islice(self, start, stop=None):
+        from itertools import islice
+        from .jfio import jsonl_index, yield_record_range
+
+        index = jsonl_index(self.fn)
+        if index is None:
+            return islice(self.records, start, stop)
+        return yield_record_range(self.fn, start, stop, lazy=self.lazy, index=index)
+
+    def tail(self, count):
+        from collections import deque
+        from .jfio import jsonl_index, yield_last_records
+
+        if jsonl_index(self.fn) is None:
+            return iter(deque(self.records, maxlen=count) if count > 0 else ())
+        return yield_last_records(self.fn, count, lazy=self.lazy)
+
+
+class RawRecords:
+    """
+    Records read as raw json that worker processes parse themselves
+
+    Iterating yields the parsed records. mymap hands batches of the raw
+    items to the workers instead, and with a serializer the workers also
+    write the output of the batch. With lazy, objects are parsed into
+    LazyRecords.
+    """
+
+    def __init__(self, items, serializer=None, lazy=False):
+        self.items = items
+        self.serializer = serializer
+        self.lazy = lazy
+
+    def __iter__(self):
+        return (_parse_raw(item, self.lazy) for item in self.items)
+
+
+def _parse_raw(item, lazy=False):
+    global _jsonlgen
+    if type(item) is not bytes:
+        return item
+    from .jfio import try_json_loads, LAZY_MIN_SIZE
+
+    if lazy and len(item) >= LAZY_MIN_SIZE and item.lstrip()[:1] == b"{":
+        return LazyRecord(item)
+    if _jsonlgen is None:
+        from . import jsonlgen as _jsonlgen
+    return _jsonlgen.loads(item, try_json_loads)
+
+
+class AdaptiveBatches:
+    """
+    Batches of items sized so that a worker spends about seconds on each
+
+    Batches start small. measured() is given the time the workers took for
+    a batch, and later batches follow the measured cost per item.
+
+    >>> batches = AdaptiveBatches(range(100), seconds=0.01, size=2)
+    >>> it = iter(batches)
+    >>> next(it)
+    [0, 1]
+    >>> batches.measured(2, 0.0001)
+    >>> len(next(it))
+    98
+    """
+
+    def __init__(self, items, seconds=0.02, size=16, max_size=1 << 16):
+        self.items = iter(items)
+        self.seconds = seconds
+        self.size = size
+        self.max_size = max_size
+
+    def measured(self, count, elapsed):
+        if count and elapsed > 0:
+            size = self.seconds * count / elapsed
+            # Halfway towards the measured size, so one odd batch can not swing it
+            self.size = int(min(max((self.size + size) / 2, 1), self.max_size))
+
+    def __iter__(self):
+        from itertools import islice
+
+        while True:
+            batch = list(islice(self.items, self.size))
+            if not batch:
+                return
+            yield batch
+
+
+def _process(records, serializer):
+    """Per record stages over records, then the aggregate or serializer"""
+    results = []
+    for x in records:
+        x = worker(x)
+        if x is not JFREMOVED:
+            results.append(x)
+    if _aggregate is not None:
+        return _aggregate.partial(results)
+    if serializer is not None:
+        lines = []
+        for x in results:
+            lines.append(serializer(x))
+            lines.append("\n")
+        return SerializedLines("".join(lines).encode())
+    return results
+
+
+def batch_worker(task):
+    """
+    Parse, process and, with a serializer, serialize a batch of records
+
+    Returns the results, or the partial result of the aggregate given to
+    worker_init, the number of records and the seconds it took.
+
+    >>> worker_init([["filter", lambda x: x.a > 1], ["map", lambda x: x.a]])
+    >>> batch_worker(([b'{"a": 1}', b'{"a": 2}', {"a": 3}], str, False))[:2]
+    (b'2\\n3\\n', 3)
+    >>> batch_worker(([b'{"a": 1}', b'{"a": 2}'], None, True))[:2]
+    ([2], 2)
+    """
+    from time import perf_counter
+
+    items, serializer, lazy = task
+    start = perf_counter()
+    results = _process((_parse_raw(x, lazy) for x in items), serializer)
+    return results, len(items), perf_counter() - start
+
+
+def map_batches(
+    pool, batches, serializer=None, lazy=False, window=8, unordered=False
+):
+    """
+    Run batch_worker on the batches in the pool, yielding results in order
+
+    At most window batches are in flight, so the input is read only as fast
+    as the workers process it and the batch sizes adapt. With unordered,
+    results are yielded as soon as any batch is done.
+    """
+    from collections import deque
+    from queue import Queue
+
+    pending = deque()
+    finished = Queue()
+
+    def done():
+        if unordered:
+            pending.pop()
+            result = finished.get()
+            if isinstance(result, BaseException):
+                raise result
+            results, count, elapsed = result
+        else:
+            results, count, elapsed = pending.popleft().get()
+        batches.measured(count, elapsed)
+        return results
+
+    for batch in batches:
+        task = (batch, serializer, lazy)
+        if unordered:
+            result = pool.apply_async(
+                batch_worker,
+                (task,),
+                callback=finished.put,
+                error_callback=finished.put,
+            )
+        else:
+            result = pool.apply_async(batch_worker, (task,))
+        pending.append(result)
+        if len(pending) >= window:
+            yield done()
+    while pending:
+        yield done()
+
+
+def shard_worker(task):
+    """
+    Parse, process and serialize a byte range of a json lines file
+
+    >>> import tempfile
+    >>> worker_init([["map", lambda x: x.a], ["filter", lambda x: x > 1]])
+    >>> with tempfile.NamedTemporaryFile(suffix=".jsonl") as tmpfile:
+    ...     tmpfile.write(b'{"a": 1}\\n{"a": 2}\\n{"a": 3}\\n') and True
+    ...     tmpfile.flush()
+    ...     shard_worker((tmpfile.name, 0, 18, str, False))
+    True
+    b'2\\n'
+    """
+    from .jfio import yield_mmap_json, try_json_loads
+
+    fn, start, end, serializer, lazy = task
+    records = yield_mmap_json(
+        fn, loads=try_json_loads, start=start, end=end, lazy=lazy
+    )
+    return _process(records, serializer)
+
+
 def worker(x):
     """
     worker for multiprocessing
@@ -98,64 +634,165 @@ def worker(x):
     >>> worker({"a": 1})
     {'a': 1}
     """
+    x = dotaccessible(x)
     for op, _func in _funcs:
         if op == "map":
-            x = _func(dotaccessible(x))
+            x = dotaccessible(_func(x))
         elif op == "update":
-            x.update(_func(dotaccessible(x)))
+            type(x).update(x, _func(x))
         elif op == "function":
-            x = _func(dotaccessible(x))(dotaccessible(x))
+            x = dotaccessible(_func(x)(x))
         elif op == "filter":
-            test = _func(dotaccessible(x))
-            if not test:
+            if not _func(x):
                 return JFREMOVED
     return x
 
 
-def dict_updater(_f):
-    def _update_dict(x):
-        return dict(x, **_f(x))
+_fused_code = {}
 
-    return _update_dict
 
+def fuse(stages):
+    """
+    Compile consecutive map, update and filter stages into one generator
+
+    All stages run on a record in a single frame. A record is wrapped with
+    dotaccessible once and again only after a map stage replaced it, and
+    updates are done in place on records the pipeline created itself or that
+    were read as LazyRecords. Records that were already wrapped are only
+    copied when a stage updates them.
+
+    >>> fused = fuse([["filter", lambda x: x.a > 1],
+    ...               ["update", lambda x: {"b": x.a * 2}],
+    ...               ["map", lambda x: x.b]])
+    >>> list(fused([{"a": 1}, {"a": 2}]))
+    [4]
+    >>> record = DotAccessible({"a": 1})
+    >>> list(fuse([["update", lambda x: {"b": 2}]])([record])), record
+    ([{'a': 1, 'b': 2}], {'a': 1})
+    """
+    env = {
+        "dotaccessible": dotaccessible,
+        "DotAccessible": DotAccessible,
+        "LazyRecord": LazyRecord,
+    }
+    code = ["def fused(arr):", "    for x in arr:"]
+    wrap = [
+        "        _x = dotaccessible(x)",
+        "        owned = _x is not x or type(x) is LazyRecord",
+        "        x = _x",
+    ]
+    wrapped = False
+    for idx, (op, _f) in enumerate(stages):
+        env[f"f{idx}"] = _f
+        if not wrapped:
+            code += wrap
+            wrapped = True
+        if op == "map":
+            code.append(f"        x = f{idx}(x)")
+            wrapped = False
+        elif op == "filter":
+            code += [f"        if not f{idx}(x):", "            continue"]
+        elif op == "update":
+            code += [
+                f"        _u = f{idx}(x)",
+                "        if not owned:",
+                "            x = DotAccessible(x)",
+                "            owned = True",
+                "        type(x).update(x, _u)",
+            ]
+        else:
+            raise NotImplementedError(op)
+    code.append("        yield x")
+    code = "\n".join(code)
+    if code not in _fused_code:
+        _fused_code[code] = compile(code, "<jf query>", "exec")
+    exec(_fused_code[code], env)
+    return env["fused"]
+
+
+def run_stages(fs, arr):
+    """
+    Run the query stages on arr in this process
 
-def mymap(fs, arr, processes=1):
+    Runs of map, update and filter stages are fused into one generator.
+    """
+    stages = []
+    for op, _f in fs:
+        if op != "function":
+            stages.append((op, _f))
+            continue
+        if stages:
+            arr = fuse(stages)(arr)
+            stages = []
+        transformation = _f(1)
+        if isinstance(arr, SeekableFile) and hasattr(transformation, "seek"):
+            arr = transformation.seek(arr)
+        else:
+            arr = transformation(map(dotaccessible, arr))
+    if stages:
+        arr = fuse(stages)(arr)
+    return arr
+
+
+def mymap(fs, arr, processes=1, unordered=False):
     """My mapping function
 
     Apply functions in fs to items in arr. Also supports multiprocessing.
 
-    """
-    if processes > 1:
-        from multiprocessing import Pool
+    With processes the stages before the first function stage run in worker
+    processes on adaptively sized batches of records. When they are the
+    whole pipeline and arr is a RawRecords with a serializer, the workers
+    parse and serialize the records too and yield SerializedLines. When the
+    first function stage has a combine method (see JFTransformation), the
+    workers also compute its partial result for each batch.
 
-        with Pool(
-            processes,
-            initializer=worker_init,
-            initargs=([(op, f) for op, f in fs if op != "function"],),
-        ) as pool:
-            ret = pool.imap(worker, arr, chunksize=16)
-            for op, f in fs:
-                if op == "function":
-                    ret = f(ret)(map(dotaccessible, ret))
-            yield from filter(lambda x: x != JFREMOVED, ret)
-    else:
-        for op, _f in fs:
-            if op == "map":
-                arr = map(_f, map(dotaccessible, arr))
-            elif op == "update":
-                arr = map(dict_updater(_f), map(dotaccessible, arr))
-            elif op == "function":
-                arr = _f(1)(map(dotaccessible, arr))
-            elif op == "filter":
-                arr = filter(_f, map(dotaccessible, arr))
-        yield from arr
-
-
-def camel_to_snake(name):
-    import re
-
-    name = re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
-    return name
+    With unordered, the results of the workers are used in the order they
+    are done, unless a function stage depends on the order of the items
+    (see JFTransformation.ordered).
+    """
+    # Stages up to the first function run per record in the workers
+    split = next((i for i, (op, f) in enumerate(fs) if op == "function"), len(fs))
+    per_record, rest = fs[:split], fs[split:]
+    aggregate = None
+    if processes > 1 and rest:
+        transformation = rest[0][1](1)
+        if hasattr(transformation, "combine"):
+            # The workers compute partial results that are combined here
+            aggregate, rest = transformation, rest[1:]
+    if processes < 2 or not (per_record or aggregate):
+        yield from run_stages(fs, arr)
+        return
+    if unordered:
+        transformations = [f(1) for op, f in fs if op == "function"]
+        unordered = not any(getattr(t, "ordered", False) for t in transformations)
+    from multiprocessing import Pool
+
+    with Pool(
+        processes, initializer=worker_init, initargs=(per_record, aggregate)
+    ) as pool:
+        serializer = None
+        if isinstance(arr, ShardedFile) and (aggregate or not rest):
+            # Workers read, process and serialize their own byte ranges
+            imap = pool.imap_unordered if unordered else pool.imap
+            ret = imap(shard_worker, arr.tasks(processes))
+            serializer = None if aggregate else arr.serializer
+        else:
+            lazy = False
+            if isinstance(arr, RawRecords):
+                serializer = None if rest or aggregate else arr.serializer
+                arr, lazy = arr.items, arr.lazy
+            batches = AdaptiveBatches(arr)
+            ret = map_batches(
+                pool, batches, serializer, lazy, 2 * processes, unordered
+            )
+        if serializer is not None:
+            yield from ret
+            return
+        if aggregate:
+            ret = aggregate.combine(ret)
+        else:
+            ret = (x for batch in ret for x in batch)
+        yield from run_stages(rest, ret)
 
 
 def HttpServe(fs, listen, processes):
@@ -222,16 +859,7 @@ def HttpServe(fs, listen, processes):
     @app.route("/", methods=["POST", "PUT"])
     def index():
         data.append(request.json)
-        arr = [request.json]
-        for op, _f in fs:
-            if op == "map":
-                arr = map(_f, map(dotaccessible, arr))
-            elif op == "update":
-                arr = map(dict_updater(_f), map(dotaccessible, arr))
-            elif op == "function":
-                arr = _f(1)(map(dotaccessible, arr))
-            elif op == "filter":
-                arr = filter(_f, map(dotaccessible, arr))
+        arr = run_stages(fs, [request.json])
         ret = undotaccessible(next(arr))
         results.append(ret)
         return json.dumps(ret)
@@ -239,7 +867,109 @@ def HttpServe(fs, listen, processes):
     app.run(host="0.0.0.0", port=listen)
 
 
-def run_query(query, data, additionals={}, from_file=False, processes=1, listen=False):
+def query_functions():
+    """
+    The jf functions available in queries, by their query names
+
+    >>> query_functions()["head"] is query_functions()["first"]
+    True
+    """
+    from . import extra_functions
+    from .meta import REGISTRY
+
+    return REGISTRY["function"]
+
+
+def import_modules(imports, import_path=()):
+    """
+    Import modules for queries, by name or as name=module
+
+    >>> sorted(import_modules(["hashlib", "p=os.path"]))
+    ['hashlib', 'p']
+    >>> import sys
+    >>> paths = len(sys.path)
+    >>> _ = import_modules(["hashlib"]), import_modules(["hashlib"])
+    >>> len(sys.path) == paths
+    True
+    """
+    import importlib
+    import os
+    import sys
+
+    for path in [os.path.dirname(".")] + list(import_path or ()):
+        if path not in sys.path:
+            sys.path.append(path)
+    from .meta import register_module
+
+    modules = {
+        imp.split("=")[0].split(".")[0]: importlib.import_module(imp.split("=")[-1])
+        for imp in imports
+    }
+    for module in modules.values():
+        register_module(module)
+    return modules
+
+
+class Query:
+    """
+    Query compiled once and run on any number of iterables
+
+    The query is parsed, compiled and its init code run when the Query is
+    created. Calling it only evaluates the stages over the given data.
+
+    >>> query = Query("(.a > 1), {b: hashlib.md5(str(.a).encode()).hexdigest()[:6]}",
+    ...               imports=["hashlib"])
+    >>> list(query([{"a": 1}, {"a": 2}])), list(query([{"a": 3}]))
+    ([{'b': 'c81e72'}], [{'b': 'eccbc8'}])
+    >>> list(Query("{a: .a + n}", init=["globals().update(n=10)"])([{"a": 1}]))
+    [{'a': 11}]
+    """
+
+    def __init__(
+        self,
+        query,
+        imports=(),
+        init=(),
+        additionals=None,
+        from_file=False,
+        import_path=(),
+        processes=1,
+        unordered=False,
+    ):
+        from .query_parser import parse_query
+
+        self.query = query
+        self.processes = processes
+        self.unordered = unordered
+        queries, imports, import_path, self.inputfmt, init = parse_query(
+            query, from_file, imports, import_path, inputfmt=None, init=init
+        )
+        self.queries = queries
+        modules = import_modules(imports, import_path)
+        self.world = dict(query_functions())
+        self.world.update(modules)
+        self.world.update(additionals or {})
+        for code in init:
+            eval(parse_query(code, dosplit=False), self.world)
+        self.stages = eval(queries, self.world)
+
+    def __call__(self, data):
+        """Iterator over the results of the query for data"""
+        return mymap(self.stages, data, self.processes, self.unordered)
+
+    def __repr__(self):
+        return f"Query({self.query!r})"
+
+
+def run_query(
+    query,
+    data,
+    additionals={},
+    from_file=False,
+    processes=1,
+    listen=False,
+    unordered=False,
+):
     """
     Run query. This function will utilize global imports if used as a library:
 
@@ -247,28 +977,13 @@ def run_query(query, data, additionals={}, from_file=False, processes=1, listen=
     >>> list(run_query('.a', [{"a": "521"}, {"a": "643"}]))
     ['521', '643']
     """
-    from .query_parser import parse_query
-    from . import extra_functions
+    from .query_parser import parse_query, compile_query
 
     # query
     queries, imports, import_path, _, _ = parse_query(query, from_file, [], [], False)
 
-    name_alternatives = {
-        "first": ["head"],
-        "last": ["tail"],
-        "firstnlast": ["headntail"],
-    }
-
     # environment
-    world = dict(
-        {"data": data, "mymap": mymap},
-        **{
-            camel_to_snake(k): getattr(extra_functions, orig_k)
-            for orig_k in dir(extra_functions)
-            if orig_k[0] != "_"
-            for k in name_alternatives.get(camel_to_snake(orig_k), []) + [orig_k]
-        },
-    )
+    world = dict({"data": data, "mymap": mymap}, **query_functions())
     if additionals:
         world.update(additionals)
     else:
@@ -290,4 +1005,4 @@ def run_query(query, data, additionals={}, from_file=False, processes=1, listen=
         return eval(f"HttpServe({queries}, {listen}, {processes})", world)
     else:
         # process
-        return eval(f"mymap({queries}, data, {processes})", world)
+        return eval(compile_query(queries, processes, unordered), world)
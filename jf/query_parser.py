@@ -100,6 +100,210 @@ def query_convert(query, debug=False):
     return query
 
 
+def cache_dir():
+    """Directory of the compiled query cache, JF_CACHE_DIR or ~/.cache/jf"""
+    import os
+
+    if os.environ.get("JF_CACHE_DIR"):
+        return os.environ["JF_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "jf")
+
+
+# Entries kept in memory and on disk, the oldest ones are removed first
+CACHE_MAX_ENTRIES = 1000
+_memory_cache = {}
+_jf_version = None
+
+
+def jf_version():
+    """
+    Names and modification times of the modules of jf
+
+    They change with every installed version and with every change to a
+    module, like the parser or the functions that compiled queries call.
+    """
+    global _jf_version
+    if _jf_version is None:
+        import os
+
+        directory = os.path.dirname(os.path.abspath(__file__))
+        _jf_version = tuple(
+            sorted(
+                (fn, os.stat(os.path.join(directory, fn)).st_mtime_ns)
+                for fn in os.listdir(directory)
+                if fn.endswith((".py", ".so", ".pyd"))
+            )
+        )
+    return _jf_version
+
+
+def cache_key(*parts):
+    """Cache key of parts for this jf and python version"""
+    import sys
+
+    return repr((sys.version, jf_version(), parts))
+
+
+def _cache_file(key):
+    import os
+    import zlib
+
+    # zlib is much faster to import than hashlib. Entries store their whole
+    # key, so colliding checksums only cause cache misses.
+    name = f"{zlib.crc32(key.encode()):08x}{zlib.adler32(key.encode()):08x}.jfc"
+    return os.path.join(cache_dir(), name)
+
+
+def cache_get(key):
+    """Cached value of key from memory or from disk, None if there is none"""
+    import marshal
+    import os
+
+    data = _memory_cache.get(key)
+    if data is None:
+        if os.environ.get("JF_NO_CACHE"):
+            return None
+        try:
+            with open(_cache_file(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+    try:
+        stored_key, value = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return None
+    if stored_key != key:
+        return None
+    _remember(key, data)
+    return value
+
+
+def _remember(key, data):
+    _memory_cache[key] = data
+    if len(_memory_cache) > CACHE_MAX_ENTRIES:
+        del _memory_cache[next(iter(_memory_cache))]
+
+
+def cache_put(key, value):
+    """Store a marshallable value in memory and on disk, if possible"""
+    import marshal
+    import os
+
+    data = marshal.dumps((key, value))
+    _remember(key, data)
+    if os.environ.get("JF_NO_CACHE"):
+        return
+    fn = _cache_file(key)
+    tmpfn = f"{fn}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(tmpfn, "wb") as f:
+            f.write(data)
+        os.replace(tmpfn, fn)
+        evict_cache()
+    except OSError:
+        # The cache is an optimization only
+        if os.path.exists(tmpfn):
+            os.unlink(tmpfn)
+
+
+def evict_cache(max_entries=None):
+    """
+    Remove the oldest entries of the disk cache beyond max_entries
+
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     os.environ["JF_CACHE_DIR"] = tmpdir
+    ...     for i in range(3):
+    ...         cache_put(cache_key("evict", i), i)
+    ...     removed = evict_cache(max_entries=1)
+    ...     entries = cache_info()["entries"]
+    ...     del os.environ["JF_CACHE_DIR"]
+    >>> removed, entries
+    (2, 1)
+    """
+    import os
+
+    max_entries = CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    directory = cache_dir()
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".jfc"):
+            try:
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+            except OSError:
+                pass
+    removed = 0
+    for _, path in sorted(entries)[: max(len(entries) - max_entries, 0)]:
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def cache_info():
+    """
+    Location, number of entries and size of the compiled query cache
+
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     os.environ["JF_CACHE_DIR"] = tmpdir
+    ...     cache_put(cache_key("test"), 1)
+    ...     entries = cache_info()["entries"]
+    ...     removed = clear_cache()
+    ...     del os.environ["JF_CACHE_DIR"]
+    >>> entries, removed
+    (1, 1)
+    """
+    import os
+
+    directory = cache_dir()
+    entries = 0
+    size = 0
+    if os.path.isdir(directory):
+        for fn in os.listdir(directory):
+            if fn.endswith(".jfc"):
+                entries += 1
+                size += os.path.getsize(os.path.join(directory, fn))
+    return {"directory": directory, "entries": entries, "bytes": size}
+
+
+def clear_cache():
+    """Remove all entries of the compiled query cache, returns their number"""
+    import os
+
+    _memory_cache.clear()
+    directory = cache_dir()
+    removed = 0
+    if os.path.isdir(directory):
+        for fn in os.listdir(directory):
+            if fn.endswith(".jfc"):
+                os.unlink(os.path.join(directory, fn))
+                removed += 1
+    return removed
+
+
+def compile_query(queries, processes=1, unordered=False):
+    """
+    Code object that runs the parsed queries over data with mymap
+
+    >>> eval(compile_query("[]"), {"mymap": lambda *args: args, "data": 1})
+    ([], 1, 1, False)
+    """
+    key = cache_key("compile", queries, processes, unordered)
+    code = cache_get(key)
+    if code is None:
+        code = f"mymap({queries}, data, {processes}, {unordered})"
+        code = compile(code, "<jf query>", "eval")
+        cache_put(key, code)
+    return code
+
+
 def parse_query(
     query,
     from_file=None,
@@ -111,7 +315,10 @@ def parse_query(
     init=[],
 ):
     """
-    Parse user query
+    Parse user query, or reuse the result of an earlier parse from the cache
+
+    The cache is keyed by the query text or .jf script contents, the
+    imports and the jf version.
 
     >>> parse_query("{A: .b}, {c: .A, ...}, (.c>1),unique(), yield from .a")
     ('[["map", lambda x: {"A": x.b}], ["update", lambda x: {"c": x.A}], ["filter", lambda x: (x.c>1)], ["function", lambda x: unique(lambda x: ())], ["function", lambda x: yield_from(lambda x: x.a)]]', [], None, None, [])
@@ -129,6 +336,47 @@ def parse_query(
     True
     ('[["update", lambda x: {"hash": hashlib.md5(x.a).hexdigest()}]]', ['hashlib'], None, None, [])
     """
+    is_file = bool(from_file) or query.endswith(".jf")
+    if debug or not dosplit:
+        return _parse_query(
+            query, from_file, imports, import_path, debug, dosplit, inputfmt, list(init)
+        )
+    source = query
+    if is_file:
+        try:
+            with open(query, "r") as f:
+                source = f.read()
+        except OSError:
+            source = None
+    key = cache_key(
+        "parse",
+        source,
+        is_file,
+        list(imports),
+        None if import_path is None else list(import_path),
+        inputfmt,
+        list(init),
+    )
+    ret = cache_get(key) if source is not None else None
+    if ret is None:
+        ret = _parse_query(
+            query, from_file, imports, import_path, debug, dosplit, inputfmt, list(init)
+        )
+        cache_put(key, ret)
+    return ret
+
+
+def _parse_query(
+    query,
+    from_file=None,
+    imports=[],
+    import_path=None,
+    debug=False,
+    dosplit=True,
+    inputfmt=None,
+    init=[],
+):
+    """Parse user query without the cache"""
     if debug:
         print("query_parse:")
     if from_file or query.endswith(".jf"):
@@ -170,3 +418,244 @@ def parse_query(
 
         sys.stderr.write(queries + "\n")
     return queries, imports, import_path, inputfmt, init
+
+
+# Functions that pass records through unchanged apart from order and count.
+# print is left out since it shows the whole records.
+PASSTHROUGH_FUNCTIONS = ("first", "head", "last", "tail", "sorted", "unique")
+DICT_METHODS = set(dir(dict))
+
+
+def _lambda_fields(node):
+    """
+    Top-level fields of x read in a lambda x: ... expression
+
+    Returns None if x is used in any other way than x.field.
+    """
+    import ast
+
+    fields = set()
+    attribute_values = set()
+    for it in ast.walk(node.body):
+        if isinstance(it, ast.Attribute) and isinstance(it.value, ast.Name):
+            if it.value.id == "x":
+                if it.attr in DICT_METHODS or it.attr.startswith("_"):
+                    return None
+                fields.add(it.attr)
+                attribute_values.add(id(it.value))
+    for it in ast.walk(node.body):
+        if isinstance(it, ast.Name) and it.id == "x" and id(it) not in attribute_values:
+            return None
+    return fields
+
+
+def _projection(node):
+    """
+    The lambda x: ... mapped over the stream by a plain projection like .a
+
+    Such queries are parsed to lambda y: map(lambda x: x.a, y).
+    """
+    import ast
+
+    if (
+        isinstance(node, ast.Lambda)
+        and len(node.args.args) == 1
+        and isinstance(node.body, ast.Call)
+        and isinstance(node.body.func, ast.Name)
+        and node.body.func.id == "map"
+        and len(node.body.args) == 2
+        and isinstance(node.body.args[0], ast.Lambda)
+        and isinstance(node.body.args[1], ast.Name)
+        and node.body.args[1].id == node.args.args[0].arg
+    ):
+        return node.body.args[0]
+    return None
+
+
+def query_fields(queries):
+    """
+    Top-level fields of the input records that a parsed query reads
+
+    Returns None when the query may need every field: the records reach the
+    output whole, or a stage uses the records in a way that can not be
+    analysed.
+
+    >>> sorted(query_fields(parse_query("{id: .id, ts: .ts}")[0]))
+    ['id', 'ts']
+    >>> sorted(query_fields(parse_query("(.a > 1), sorted(.c), first(3), {b: .b}")[0]))
+    ['a', 'b', 'c']
+    >>> query_fields(parse_query("{a: .b, ...}")[0]) is None
+    True
+    >>> query_fields(parse_query("group_by(.a), {b: .b}")[0]) is None
+    True
+    >>> query_fields(parse_query("{a: x}")[0]) is None
+    True
+    >>> sorted(query_fields(parse_query(".a.b, first(3)")[0]))
+    ['a']
+    >>> query_fields(parse_query("print(1), {b: .b}")[0]) is None
+    True
+    """
+    import ast
+
+    try:
+        stages = ast.parse(queries, mode="eval").body.elts
+    except (SyntaxError, AttributeError):
+        return None
+    fields = set()
+    for stage in stages:
+        op, fun = ast.literal_eval(stage.elts[0]), stage.elts[1]
+        if op == "function" and _projection(fun.body) is not None:
+            op, fun = "map", _projection(fun.body)
+        if op == "function":
+            call = fun.body
+            if not (
+                isinstance(call, ast.Call)
+                and isinstance(call.func, ast.Name)
+                and call.func.id in PASSTHROUGH_FUNCTIONS
+            ):
+                return None
+            for arg in call.args:
+                if not isinstance(arg, ast.Lambda):
+                    return None
+                used = _lambda_fields(arg)
+                if used is None:
+                    return None
+                fields |= used
+            continue
+        used = _lambda_fields(fun)
+        if used is None:
+            return None
+        fields |= used
+        if op == "map":
+            return fields
+    return None
+
+
+# Comparisons that hold for null values in python, like != and not in, are
+# not pushed down: pyarrow drops the rows where the field is null
+COMPARE_OPS = {
+    "Eq": "==",
+    "Lt": "<",
+    "LtE": "<=",
+    "Gt": ">",
+    "GtE": ">=",
+    "In": "in",
+}
+FLIPPED_OPS = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "=="}
+
+
+def _field_name(node):
+    import ast
+
+    if (
+        isinstance(node, ast.Attribute)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "x"
+        and node.attr not in DICT_METHODS
+        and not node.attr.startswith("_")
+    ):
+        return node.attr
+    return None
+
+
+def _literal(node):
+    import ast
+
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        return None, False
+    if isinstance(value, (list, tuple, set)):
+        if not all(isinstance(v, (str, int, float, bool)) for v in value):
+            return None, False
+        return list(value), True
+    if isinstance(value, (str, int, float, bool)):
+        return value, True
+    return None, False
+
+
+def _compare_filters(node):
+    """
+    Conjunction of (field, op, value) tuples equivalent to a comparison
+
+    Only plain fields compared with literals are understood, anything else
+    returns None.
+    """
+    import ast
+
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        filters = []
+        for value in node.values:
+            part = _compare_filters(value)
+            if part is None:
+                return None
+            filters += part
+        return filters
+    if not isinstance(node, ast.Compare):
+        return None
+    filters = []
+    left = node.left
+    for op, right in zip(node.ops, node.comparators):
+        op = COMPARE_OPS.get(type(op).__name__)
+        if op is None:
+            return None
+        field, (value, ok) = _field_name(left), _literal(right)
+        if field is None and op in FLIPPED_OPS:
+            field, (value, ok) = _field_name(right), _literal(left)
+            op = FLIPPED_OPS[op]
+        if field is None or not ok or isinstance(value, list) != op.endswith("in"):
+            return None
+        filters.append((field, op, value))
+        left = right
+    return filters
+
+
+def query_filters(queries):
+    """
+    Row filters that can be applied while reading the input of a parsed query
+
+    Leading filter stages that compare plain fields with literals are
+    returned as a list of (field, op, value) tuples, all of which have to
+    hold. The format is the one pyarrow.parquet uses for filters. Filters that
+    can not be expressed so are left out, so the query itself still has to
+    evaluate its filter stages.
+
+    >>> query_filters(parse_query('(.status == 500), (.ts > "2026-01-01")')[0])
+    [('status', '==', 500), ('ts', '>', '2026-01-01')]
+    >>> query_filters(parse_query('(1 < .a <= 5 and .b in ["x", "y"]), {a}')[0])
+    [('a', '>', 1), ('a', '<=', 5), ('b', 'in', ['x', 'y'])]
+    >>> query_filters(parse_query('(.a > .b), (.c == 1)')[0])
+    [('c', '==', 1)]
+    >>> query_filters(parse_query('(.status != 500), (.b not in [1])')[0])
+    []
+    >>> query_filters(parse_query('{a: .b}, (.a == 1)')[0])
+    []
+    """
+    import ast
+
+    try:
+        stages = ast.parse(queries, mode="eval").body.elts
+    except (SyntaxError, AttributeError):
+        return []
+    filters = []
+    for stage in stages:
+        if ast.literal_eval(stage.elts[0]) != "filter":
+            break
+        filters += _compare_filters(stage.elts[1].body) or []
+    return filters
+
+
+def query_pushdown(queries):
+    """
+    query_fields and query_filters of parsed queries, cached like the queries
+
+    >>> fields, filters = query_pushdown(parse_query("(.a > 1), {b: .b}")[0])
+    >>> sorted(fields), filters
+    (['a', 'b'], [('a', '>', 1)])
+    """
+    key = cache_key("pushdown", queries)
+    ret = cache_get(key)
+    if ret is None:
+        ret = query_fields(queries), query_filters(queries)
+        cache_put(key, ret)
+    return ret
@@ -14,3 +14,197 @@ def test_main():
         )
         assert result.exit_code == 0, repr((result.exit_code, result.output))
         assert result.output == '"myvalue"\n', repr(result.output)
+
+
+def test_remote_inputs():
+    import gzip
+    import os
+    import threading
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(3):
+            with open(os.path.join(tmpdir, f"{i}.jsonl.gz"), "wb") as f:
+                f.write(gzip.compress(b'{"a": %d}\n{"a": %d}\n' % (2 * i, 2 * i + 1)))
+        with open(os.path.join(tmpdir, "x.csv"), "wb") as f:
+            f.write(b"a,b\n6,x\n")
+        class Handler(SimpleHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        handler = partial(Handler, directory=tmpdir)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}"
+            result = runner.invoke(
+                main,
+                ["-c", ".a"] + [f"{url}/{i}.jsonl.gz" for i in range(3)],
+            )
+            assert result.exit_code == 0, repr((result.exit_code, result.output))
+            assert result.output == "0\n1\n2\n3\n4\n5\n", repr(result.output)
+            result = runner.invoke(main, ["-c", ".a", f"{url}/x.csv"])
+            assert result.output == "6\n", repr(result.output)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_import_time():
+    """Running a simple query imports only what it needs, within a time budget"""
+    import os
+    import subprocess
+    import sys
+
+    budget_us = 200000
+    heavy = ("pygments", "pandas", "numpy", "yaml", "dateparser", "requests")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "small.json")
+        with open(fn, "w") as f:
+            f.write('{"a": 1}\n')
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]),
+            PYTHONPYCACHEPREFIX=tmpdir,
+            JF_CACHE_DIR=tmpdir,
+        )
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        cmd = [sys.executable, "-X", "importtime", "-m", "jf", ".a", fn]
+        # The first run writes the bytecode and query caches
+        for _ in range(2):
+            result = subprocess.run(
+                cmd, env=env, cwd=root, capture_output=True, text=True
+            )
+        assert result.stdout == "1\n", result.stderr
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "[us]" not in line:
+            _, cumulative, name = line.split("|")
+            imported[name.rstrip()] = int(cumulative)
+    modules = {name.strip().split(".")[0] for name in imported}
+    assert not modules.intersection(heavy), modules.intersection(heavy)
+    # Top level imports, apart from the interpreter startup
+    total = sum(
+        us for name, us in imported.items() if name[1] != " " and name != " site"
+    )
+    assert total < budget_us, sorted(imported.items(), key=lambda it: -it[1])[:10]
+
+
+def test_parquet_pushdown():
+    """Columns and filters read from parquet match the plain query"""
+    import os
+    import pytest
+
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "x.parquet")
+        table = pa.table({"id": [1, 2, 3], "status": [500, None, 200]})
+        pq.write_table(table, fn)
+        for query in ["{id}", ".id"]:
+            result = runner.invoke(main, ["-c", query, fn])
+            assert result.exit_code == 0, repr((result.exit_code, result.output))
+        result = runner.invoke(main, ["-c", ".id", fn])
+        assert result.output == "1\n2\n3\n", repr(result.output)
+        result = runner.invoke(main, ["-c", "(.status != 500), {id}", fn])
+        assert result.output == '{"id": 2}\n{"id": 3}\n', repr(result.output)
+
+
+def test_seek_pretty_printed():
+    """last and islice read pretty printed json as a stream"""
+    import json
+    import os
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "pretty.json")
+        with open(fn, "w") as f:
+            for i in range(3):
+                f.write(json.dumps({"a": i}, indent=2) + "\n")
+        for query, expected in [
+            ("last(1)", [2]),
+            ("last(2)", [1, 2]),
+            ("islice(1, 2)", [1]),
+        ]:
+            result = runner.invoke(main, ["-c", query + ", .a", fn])
+            assert result.exit_code == 0, repr((result.exit_code, result.output))
+            assert result.output.split() == [str(i) for i in expected], (
+                query,
+                result.output,
+            )
+        # A multi-line record between single-line ones
+        fn = os.path.join(tmpdir, "mixed.json")
+        with open(fn, "w") as f:
+            for i in range(25):
+                f.write(json.dumps({"i": i}, indent=2 if i == 10 else None) + "\n")
+        for query, expected in [
+            ("last(11)", list(range(14, 25))),
+            ("islice(11, 13)", [11, 12]),
+        ]:
+            result = runner.invoke(main, ["-c", query + ", .i", fn])
+            assert result.exit_code == 0, repr((result.exit_code, result.output))
+            assert result.output.split() == [str(i) for i in expected], (
+                query,
+                result.output,
+            )
+        assert not os.path.exists(fn + ".jfidx")
+
+
+def test_register_example():
+    """The register example of the documentation runs as documented"""
+    import os
+    import sys
+    from jf.meta import REGISTRY
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "mytools.py"), "w") as f:
+            f.write(
+                "from jf.meta import register\n\n"
+                '@register("function", "shout")\n'
+                "def shout(value):\n"
+                "    return str(value).upper()\n"
+            )
+        fn = os.path.join(tmpdir, "data.jsonl")
+        with open(fn, "w") as f:
+            f.write('{"name": "ada"}\n{"name": "bob"}\n')
+        try:
+            result = runner.invoke(
+                main,
+                ["-c", "{name: shout(.name)}", "--import", "mytools"]
+                + ["--import_from", tmpdir, fn],
+            )
+        finally:
+            # The registry and the imported module live for the whole process
+            REGISTRY["function"].pop("shout", None)
+            sys.modules.pop("mytools", None)
+            if tmpdir in sys.path:
+                sys.path.remove(tmpdir)
+        assert result.exit_code == 0, repr((result.exit_code, result.output))
+        assert result.output == '{"name": "ADA"}\n{"name": "BOB"}\n', result.output
+
+
+def test_shard_multiline_record():
+    """A large file with multi-line records is not split at their newlines"""
+    import json
+    import os
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "mixed.json")
+        count = 20000
+        with open(fn, "w") as f:
+            for i in range(count):
+                indent = 2 if 10 <= i < count - 10 else None
+                f.write(json.dumps({"i": i, "pad": ["x"] * 8}, indent=indent) + "\n")
+        assert os.path.getsize(fn) > 1 << 20
+        result = runner.invoke(main, ["-c", "{i}", "--processes", "2", fn])
+        assert result.exit_code == 0, repr((result.exit_code, result.output[:200]))
+        expected = "".join('{"i": %d}\n' % i for i in range(count))
+        assert result.output == expected, result.output[:200]